@@ -0,0 +1,219 @@
+"""
+Local index of every SoccerNet Labels-v2.json annotation.
+
+build() walks the league/season/match folders once and stores each annotation
+as a row of (league, season, match, half, position, label, visibility, team)
+in a SQLite file, so dataset planning, sampling and statistics are answered
+by indexed queries instead of walking the folders and json.load-ing every
+label file. Queries use the index as it is; an update (the build command,
+or open_index(update=True) as label_extraction.py does) walks the folders
+and only re-reads label files that were added or changed since the previous
+build. A full rebuild is only needed if the index itself is suspect.
+
+Example:
+    python annotation_index.py build --root videos
+    python annotation_index.py build --root videos --full
+    python annotation_index.py query --update --label Goal --league england_epl --season 2015-2016 --context 5000
+    python annotation_index.py stats --group-by league season
+
+    index = AnnotationIndex("videos/annotations.sqlite")
+    goals = index.query(label="Goal", league="england_epl", season="2015-2016", context_time=5000)
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+INDEX_FILE = "annotations.sqlite"
+LABEL_FILE = "Labels-v2.json"
+
+COLUMNS = ('league', 'season', 'match', 'half', 'position', 'label', 'visibility', 'team', 'game_time', 'idx')
+FILTERS = ('league', 'season', 'match', 'half', 'label', 'visibility', 'team')
+
+class AnnotationIndex:
+    """SQLite annotation table; every call opens its own short-lived connection, so it can be shared by processes"""
+    def __init__(self, path=os.path.join("videos", INDEX_FILE)):
+        self.path = path
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS label_files (
+                league TEXT, season TEXT, match TEXT, mtime REAL, size INTEGER,
+                PRIMARY KEY (league, season, match))""")
+            # idx is the annotation's position in its Labels-v2.json, used in the clip file names
+            db.execute("""CREATE TABLE IF NOT EXISTS annotations (
+                league TEXT, season TEXT, match TEXT, half INTEGER, position INTEGER,
+                label TEXT, visibility TEXT, team TEXT, game_time TEXT, idx INTEGER)""")
+            db.execute("CREATE INDEX IF NOT EXISTS annotations_by_label ON annotations (label, league, season)")
+            db.execute("CREATE INDEX IF NOT EXISTS annotations_by_match ON annotations (league, season, match, half, position)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def is_empty(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM label_files").fetchone()[0] == 0
+
+    def build(self, root_path="videos", full=False):
+        """
+        Add new and changed label files under root_path, drop those that disappeared;
+        returns (updated, removed). With full, every label file is re-read.
+        """
+        start = time.perf_counter()
+        with self._connect() as db:
+            known = {row[:3]: row[3:] for row in db.execute("SELECT league, season, match, mtime, size FROM label_files")}
+        seen = set()
+        updated = 0
+
+        with self._connect() as db:
+            if full:
+                db.execute("DELETE FROM annotations")
+                db.execute("DELETE FROM label_files")
+                known = {}
+            for league in sorted(os.listdir(root_path)):
+                league_path = os.path.join(root_path, league)
+                if not os.path.isdir(league_path):
+                    continue
+                for season in sorted(os.listdir(league_path)):
+                    season_path = os.path.join(league_path, season)
+                    if not os.path.isdir(season_path):
+                        continue
+                    for match in sorted(os.listdir(season_path)):
+                        label_file_path = os.path.join(season_path, match, LABEL_FILE)
+                        if not os.path.exists(label_file_path):
+                            continue
+
+                        key = (league, season, match)
+                        seen.add(key)
+                        stat = os.stat(label_file_path)
+                        if known.get(key) == (stat.st_mtime, stat.st_size):
+                            continue
+
+                        with open(label_file_path) as f:
+                            data = json.load(f)
+                        db.execute("DELETE FROM annotations WHERE league = ? AND season = ? AND match = ?", key)
+                        db.executemany(f"INSERT INTO annotations VALUES ({', '.join('?' * len(COLUMNS))})",
+                                       [key + annotation_row(annotation, idx)
+                                        for idx, annotation in enumerate(data["annotations"])])
+                        db.execute("INSERT OR REPLACE INTO label_files VALUES (?, ?, ?, ?, ?)",
+                                   key + (stat.st_mtime, stat.st_size))
+                        updated += 1
+
+            removed = set(known) - seen
+            for key in removed:
+                db.execute("DELETE FROM annotations WHERE league = ? AND season = ? AND match = ?", key)
+                db.execute("DELETE FROM label_files WHERE league = ? AND season = ? AND match = ?", key)
+
+        print(f"Indexed {updated} new or changed label files, removed {len(removed)}, "
+              f"{len(seen)} matches in {time.perf_counter() - start:.1f}s")
+        return updated, len(removed)
+
+    def _where(self, filters):
+        # Each filter is a single value or a list of values
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column not in FILTERS:
+                raise ValueError(f"Unknown annotation filter: {column}")
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, context_time=None, **filters):
+        """
+        Annotations matching the filters as dicts, in file order per match.
+        With context_time (ms) each also gets the start_time/end_time of its clip.
+        """
+        where, params = self._where(filters)
+        with self._connect() as db:
+            rows = db.execute(f"SELECT {', '.join(COLUMNS)} FROM annotations{where} "
+                              "ORDER BY league, season, match, idx", params).fetchall()
+        annotations = [dict(zip(COLUMNS, row)) for row in rows]
+        if context_time is not None:
+            for annotation in annotations:
+                annotation["start_time"] = max(0, annotation["position"] - context_time)
+                annotation["end_time"] = annotation["position"] + context_time
+        return annotations
+
+    def matches(self, **filters):
+        """(league, season, match) of every indexed match with an annotation matching the filters"""
+        where, params = self._where(filters)
+        with self._connect() as db:
+            if not filters:
+                return db.execute("SELECT league, season, match FROM label_files ORDER BY league, season, match").fetchall()
+            return db.execute(f"SELECT DISTINCT league, season, match FROM annotations{where} "
+                              "ORDER BY league, season, match", params).fetchall()
+
+    def match_data(self, league, season, match):
+        """A match's annotations in the Labels-v2.json layout, so extract_events_with_context can use them unchanged"""
+        annotations = self.query(league=league, season=season, match=match)
+        return {"annotations": [{
+            "gameTime": annotation["game_time"],
+            "label": annotation["label"],
+            "position": str(annotation["position"]),
+            "team": annotation["team"],
+            "visibility": annotation["visibility"]
+        } for annotation in annotations]}
+
+    def label_counts(self, group_by=(), **filters):
+        """{(group values..., label): count} of the annotations matching the filters"""
+        for column in group_by:
+            if column not in FILTERS:
+                raise ValueError(f"Unknown annotation column: {column}")
+        columns = list(group_by) + ['label']
+        where, params = self._where(filters)
+        with self._connect() as db:
+            rows = db.execute(f"SELECT {', '.join(columns)}, COUNT(*) FROM annotations{where} "
+                              f"GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}", params).fetchall()
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+def annotation_row(annotation, idx):
+    game_time = annotation["gameTime"]
+    return (int(game_time.split(" - ")[0]), int(annotation["position"]), annotation["label"],
+            annotation.get("visibility"), annotation.get("team"), game_time, idx)
+
+def open_index(root_path="videos", index_path=None, update=False, refresh=False):
+    """
+    Index of root_path (stored in it by default), built on first use. Otherwise it
+    is used as it is, without walking the folders; with update it first picks up
+    new, changed and removed label files, and refresh rebuilds it from scratch.
+    """
+    index = AnnotationIndex(index_path or os.path.join(root_path, INDEX_FILE))
+    if update or refresh or index.is_empty():
+        index.build(root_path, full=refresh)
+    return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index and query SoccerNet Labels-v2.json annotations")
+    parser.add_argument('command', choices=['build', 'query', 'stats'])
+    parser.add_argument('--root', default='videos')
+    parser.add_argument('--index', default=None, help=f"Defaults to <root>/{INDEX_FILE}")
+    for column in FILTERS:
+        parser.add_argument(f'--{column}', nargs='+', default=None)
+    parser.add_argument('--context', type=int, default=None, help="Clip context around each event in ms")
+    parser.add_argument('--group-by', nargs='*', default=[], help="Columns to split the label counts by")
+    parser.add_argument('--update', action='store_true', help="Pick up new and changed label files before querying")
+    parser.add_argument('--full', action='store_true', help="Rebuild the index from scratch")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    index = open_index(args.root, args.index, update=args.update or args.command == 'build', refresh=args.full)
+    if args.command != 'build':
+        filters = {column: getattr(args, column) for column in FILTERS}
+        if filters['half'] is not None:
+            filters['half'] = [int(half) for half in filters['half']]
+
+        start = time.perf_counter()
+        if args.command == 'query':
+            for annotation in index.query(context_time=args.context, **filters):
+                print(json.dumps(annotation))
+        else:
+            for key, count in index.label_counts(args.group_by, **filters).items():
+                print(f"{' | '.join(str(value) for value in key)}: {count}")
+        print(f"Query took {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,429 @@
+import json
+import mmap
+import os
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, Sampler
+
+def export_features_to_memmap(features_path, output_dir, chunk_size=1024):
+    """
+    Convert a feature bundle saved by resnet50_feature_extraction.py into a flat
+    on-disk array that MemmapFeatureDataset can map without loading it into RAM.
+
+    Writes features.bin (raw float32, sample-major), labels.npy and meta.json.
+    """
+    # mmap=True keeps the source tensors on disk while they are copied out
+    try:
+        loaded_data = torch.load(features_path, mmap=True)
+    except (TypeError, RuntimeError):
+        loaded_data = torch.load(features_path)
+
+    all_features = loaded_data['features']
+    all_labels = loaded_data['labels']
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Copy in chunks so only `chunk_size` samples are resident at a time
+    with open(os.path.join(output_dir, 'features.bin'), 'wb') as f:
+        for start in range(0, len(all_features), chunk_size):
+            chunk = all_features[start:start + chunk_size].to(torch.float32).contiguous()
+            f.write(chunk.numpy().tobytes())
+
+    np.save(os.path.join(output_dir, 'labels.npy'), all_labels.cpu().numpy().astype(np.int64))
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'shape': list(all_features.shape),
+            'dtype': 'float32',
+            'label_to_index': loaded_data['label_to_index'],
+            'unique_labels': loaded_data['unique_labels']
+        }, f, indent=4)
+
+    print(f"Exported {len(all_features)} samples to {output_dir}")
+
+class MemmapFeatureDataset(Dataset):
+    """
+    Feature dataset backed by a memory-mapped file written by export_features_to_memmap.
+
+    Samples are paged in by the OS when they are read, so the dataset can be far
+    larger than RAM. Use it with random_split as usual: the resulting Subsets only
+    hold indices and share this mapping. The mapping is reopened lazily in each
+    DataLoader worker instead of being pickled.
+    """
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+        with open(os.path.join(data_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.label_to_index = meta['label_to_index']
+        self.unique_labels = meta['unique_labels']
+
+        # Labels are tiny compared to the features, keep them in memory
+        self.labels = np.load(os.path.join(data_dir, 'labels.npy'))
+        self.sample_bytes = int(np.prod(self.shape[1:])) * self.dtype.itemsize
+
+        self._file = None
+        self._mmap = None
+        self.features = None
+
+    def _open(self):
+        self._file = open(os.path.join(self.data_dir, 'features.bin'), 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.features = np.frombuffer(self._mmap, dtype=self.dtype).reshape(self.shape)
+
+    def __getstate__(self):
+        # Workers map the file themselves rather than receiving a copy of it
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_mmap'] = None
+        state['features'] = None
+        return state
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if self.features is None:
+            self._open()
+        # np.array copies the sample out of the mapping into a writable buffer
+        features = torch.from_numpy(np.array(self.features[idx]))
+        return features, torch.tensor(self.labels[idx])
+
+    def __getitems__(self, indices):
+        """Batched read used by DataLoader: prefetch every sample, then copy in file order"""
+        if self.features is None:
+            self._open()
+
+        # Ask the kernel to start reading all samples of the batch at once
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            for idx in indices:
+                start = idx * self.sample_bytes
+                aligned_start = start - start % mmap.PAGESIZE
+                self._mmap.madvise(mmap.MADV_WILLNEED, aligned_start, start + self.sample_bytes - aligned_start)
+
+        samples = {}
+        for idx in sorted(indices):
+            samples[idx] = (torch.from_numpy(np.array(self.features[idx])), torch.tensor(self.labels[idx]))
+        return [samples[idx] for idx in indices]
+
+class CachedFeatureDataset(Dataset):
+    """
+    ResNet features of variable-length clips cached by cache_backbone_features
+    (resnet34_and_gru_simultaneous.py). The cache is memory-mapped where torch
+    supports it, so processes that open the same cache share its pages.
+    """
+    def __init__(self, cache_path):
+        try:
+            cache = torch.load(cache_path, mmap=True)
+        except (TypeError, RuntimeError):
+            cache = torch.load(cache_path)
+        self.features = cache['features']
+        self.labels = cache['labels']
+        self.label_to_index = cache.get('label_to_index')
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, idx):
+        return self.features[idx].float(), self.labels[idx]
+
+def pack_video_shards(video_paths, labels, output_dir, frame_size=224, shard_bytes=2 * 1024 ** 3):
+    """
+    Decode every clip once and store its frames resized to frame_size x frame_size
+    as raw uint8 in shard files, with index.json recording where each clip lives.
+
+    ShardedVideoDataset then slices clips straight out of the mapped shards, so
+    training never decodes video again.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    frame_bytes = frame_size * frame_size * 3
+    index = []
+    unreadable = []
+    shard_number = 0
+    shard_offset = 0
+    shard_file = open(os.path.join(output_dir, f"shard_{shard_number:05d}.bin"), 'wb')
+
+    for video_path, label in zip(video_paths, labels):
+        frames = []
+        cap = cv2.VideoCapture(video_path)
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, (frame_size, frame_size)))
+        cap.release()
+
+        if not frames:
+            print(f"No frames extracted from video: {video_path}")
+            unreadable.append(video_path)
+            continue
+
+        clip_bytes = len(frames) * frame_bytes
+        if shard_offset > 0 and shard_offset + clip_bytes > shard_bytes:
+            shard_file.close()
+            shard_number += 1
+            shard_offset = 0
+            shard_file = open(os.path.join(output_dir, f"shard_{shard_number:05d}.bin"), 'wb')
+
+        shard_file.write(np.stack(frames).astype(np.uint8).tobytes())
+        index.append({
+            'video_path': video_path,
+            'label': label,
+            'shard': shard_number,
+            'offset': shard_offset,
+            'num_frames': len(frames)
+        })
+        shard_offset += clip_bytes
+
+    shard_file.close()
+
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump({'frame_size': frame_size, 'clips': index, 'unreadable': unreadable}, f)
+
+    print(f"Packed {len(index)} clips into {shard_number + 1} shards in {output_dir}")
+
+def missing_from_shards(shard_dir, video_paths):
+    """Paths in video_paths that the shards in shard_dir were not packed from (all of them when there are no shards)"""
+    index_path = os.path.join(shard_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return list(video_paths)
+    with open(index_path) as f:
+        index = json.load(f)
+    packed = {clip['video_path'] for clip in index['clips']} | set(index.get('unreadable', []))
+    return [path for path in video_paths if path not in packed]
+
+class ShardedVideoDataset(Dataset):
+    """
+    Drop-in replacement for VideoDataset that reads pre-decoded uint8 frames from
+    shards written by pack_video_shards. Pass video_paths to restrict it to a
+    split; clips come back in that order. Raises ValueError when some of the
+    paths were never packed (repack with pack_video_shards); clips that could not
+    be decoded when packing are left out with a warning.
+    """
+    def __init__(self, shard_dir, label_to_index, video_paths=None, transform=None, return_path=False):
+        self.shard_dir = shard_dir
+        self.label_to_index = label_to_index
+        self.transform = transform
+        self.return_path = return_path
+
+        with open(os.path.join(shard_dir, 'index.json')) as f:
+            index = json.load(f)
+        self.frame_size = index['frame_size']
+
+        if video_paths is None:
+            self.clips = index['clips']
+        else:
+            by_path = {clip['video_path']: clip for clip in index['clips']}
+            unreadable = set(index.get('unreadable', []))
+            missing = [path for path in video_paths if path not in by_path and path not in unreadable]
+            if missing:
+                raise ValueError(f"{len(missing)} clips are not in the shards in {shard_dir} "
+                                 f"(e.g. {missing[0]}), repack them with pack_video_shards")
+            skipped = sum(1 for path in video_paths if path in unreadable)
+            if skipped:
+                print(f"Warning: skipping {skipped} clips that could not be decoded when packing {shard_dir}")
+            self.clips = [by_path[path] for path in video_paths if path in by_path]
+
+        self._shards = {}
+
+    def __getstate__(self):
+        # Each DataLoader worker maps the shards itself
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _shard(self, shard_number):
+        if shard_number not in self._shards:
+            with open(os.path.join(self.shard_dir, f"shard_{shard_number:05d}.bin"), 'rb') as f:
+                self._shards[shard_number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._shards[shard_number]
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, idx):
+        clip = self.clips[idx]
+        shape = (clip['num_frames'], self.frame_size, self.frame_size, 3)
+        frames = np.frombuffer(self._shard(clip['shard']), dtype=np.uint8,
+                               count=int(np.prod(shape)), offset=clip['offset']).reshape(shape)
+
+        if self.transform:
+            frames = np.stack([self.transform(frame / 255.0) for frame in frames])
+            frames_tensor = torch.tensor(frames).permute(0, 3, 1, 2).float()
+        else:
+            # Normalise straight to float32, (seq_len, c, h, w)
+            frames_tensor = torch.from_numpy(frames.copy()).permute(0, 3, 1, 2).float().div_(255.0)
+
+        label_idx = self.label_to_index[clip['label']]
+        if self.return_path:
+            return frames_tensor, label_idx, clip['video_path']
+        return frames_tensor, label_idx
+
+def default_num_workers(reserve=1):
+    """DataLoader worker count from the cores this process may run on, keeping `reserve` for the training loop"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(0, cores - reserve)
+
+def loader_kwargs(device, num_workers=0, prefetch_factor=2):
+    """
+    DataLoader options for overlapping data loading with compute: pinned host
+    memory when training on CUDA and, when num_workers > 0, worker processes
+    that stay alive across epochs with batches prefetched per worker.
+
+    Workers are opt-in and only pay off for datasets that decode video; in-RAM
+    tensors gain nothing from them. Under spawn (Windows/macOS) every worker
+    re-imports the training script, so only use them from guarded code there.
+    """
+    kwargs = {
+        'num_workers': num_workers,
+        'pin_memory': device.type == 'cuda'
+    }
+    if num_workers > 0:
+        kwargs['persistent_workers'] = True
+        kwargs['prefetch_factor'] = prefetch_factor
+    return kwargs
+
+def pad_collate(batch):
+    """
+    Collate clips with different frame counts by zero-padding them to the
+    longest clip in the batch.
+
+    Returns (padded_sequences, lengths, labels) followed by any extra fields of
+    the samples (e.g. video paths) as lists.
+    """
+    sequences = [item[0] for item in batch]
+    lengths = torch.tensor([len(sequence) for sequence in sequences], dtype=torch.long)
+    padded = torch.nn.utils.rnn.pad_sequence(sequences, batch_first=True)
+    labels = torch.tensor([int(item[1]) for item in batch], dtype=torch.long)
+    extras = [list(field) for field in zip(*batch)][2:]
+    return (padded, lengths, labels, *extras)
+
+def probe_frame_counts(video_paths):
+    """Frame count of every video from its container header, without decoding it"""
+    counts = []
+    for video_path in video_paths:
+        cap = cv2.VideoCapture(video_path)
+        counts.append(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        cap.release()
+    return counts
+
+class BucketedBalancedBatchSampler(Sampler):
+    """
+    Batch sampler that keeps clips of similar length together and balances classes.
+
+    Clips are sorted by length and split into `num_buckets` buckets of equal
+    size. Each batch is drawn from a single bucket (picked in proportion to its
+    size), so pad_collate pads little; inside the bucket every slot first picks
+    a class uniformly and then a clip of that class. Rare classes are drawn more
+    often by index, nothing is copied.
+
+    Pass it to DataLoader as batch_sampler. With lengths=None (fixed-length
+    feature tensors) there is a single bucket. An epoch is `num_batches`
+    batches, by default as many as a plain pass over the data. Like
+    RandomSampler, an optional generator makes the draws reproducible.
+    """
+    def __init__(self, labels, lengths=None, batch_size=16, num_buckets=8, num_batches=None, generator=None):
+        labels = [int(label) for label in labels]
+        if lengths is None:
+            lengths = [0] * len(labels)
+            num_buckets = 1
+        self.batch_size = batch_size
+        self.num_batches = num_batches or max(1, len(labels) // batch_size)
+        self.generator = generator
+
+        order = sorted(range(len(labels)), key=lambda idx: lengths[idx])
+        num_buckets = max(1, min(num_buckets, len(order) // batch_size))
+        self.buckets = []
+        for chunk in np.array_split(np.array(order, dtype=np.int64), num_buckets):
+            by_class = {}
+            for idx in chunk.tolist():
+                by_class.setdefault(labels[idx], []).append(idx)
+            self.buckets.append([torch.tensor(indices) for indices in by_class.values()])
+        self.bucket_sizes = torch.tensor([sum(len(indices) for indices in bucket) for bucket in self.buckets],
+                                         dtype=torch.float)
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        generator = self.generator
+        if generator is None:
+            generator = torch.Generator()
+            generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+
+        for _ in range(self.num_batches):
+            bucket = self.buckets[torch.multinomial(self.bucket_sizes, 1, generator=generator).item()]
+            classes = torch.randint(len(bucket), (self.batch_size,), generator=generator).tolist()
+            positions = torch.rand(self.batch_size, generator=generator)
+            yield [bucket[c][int(position * len(bucket[c]))].item() for c, position in zip(classes, positions)]
+
+class FeatureAugmenter:
+    """
+    On-the-fly augmentation of batches of cached per-frame features, so no clip
+    is decoded or passed through the backbone again.
+
+    Each clip is augmented with probability p:
+        temporal crop:  keep a random fraction (crop_range) of its frames
+        jitter:         at a random start position
+        speed:          read the crop from a window `speed` times as long
+                        (speed_range), linearly resampled to the crop length
+    then the batch is mixed with a shuffled copy of itself (mixup, weight drawn
+    from Beta(mixup_alpha, mixup_alpha); 0 disables it).
+
+    Returns (features, lengths, targets): cropped clips are zero-padded and
+    their lengths returned for the model, targets are (mixed) one-hot labels
+    for nn.CrossEntropyLoss. Randomness comes from the global torch RNG.
+    """
+    def __init__(self, crop_range=(0.7, 1.0), speed_range=(0.8, 1.25), mixup_alpha=0.2, p=0.5, min_frames=2):
+        self.crop_range = crop_range
+        self.speed_range = speed_range
+        self.mixup_alpha = mixup_alpha
+        self.p = p
+        self.min_frames = min_frames
+
+    def __call__(self, features, labels, num_classes, lengths=None):
+        batch_size, seq_len, _ = features.shape
+        lengths = torch.full((batch_size,), seq_len) if lengths is None else lengths.cpu()
+
+        augmented = torch.zeros_like(features)
+        new_lengths = lengths.clone()
+        apply = torch.rand(batch_size) < self.p
+        crops = torch.empty(batch_size).uniform_(*self.crop_range)
+        speeds = torch.empty(batch_size).uniform_(*self.speed_range)
+        offsets = torch.rand(batch_size)
+
+        for i in range(batch_size):
+            length = int(lengths[i])
+            if not apply[i]:
+                augmented[i, :length] = features[i, :length]
+                continue
+
+            crop_len = max(min(self.min_frames, length), round(length * crops[i].item()))
+            window = max(1, min(length, round(crop_len * speeds[i].item())))
+            start = int(offsets[i] * (length - window + 1))
+            clip = features[i, start:start + window]
+            if window != crop_len:
+                # (window, features) -> (crop_len, features) along time
+                clip = F.interpolate(clip.t().unsqueeze(0), size=crop_len, mode='linear',
+                                     align_corners=True).squeeze(0).t()
+            augmented[i, :crop_len] = clip
+            new_lengths[i] = crop_len
+
+        targets = F.one_hot(labels, num_classes).to(features.dtype)
+        if self.mixup_alpha > 0:
+            lam = torch.distributions.Beta(self.mixup_alpha, self.mixup_alpha).sample().item()
+            perm = torch.randperm(batch_size)
+            augmented = lam * augmented + (1 - lam) * augmented[perm.to(features.device)]
+            targets = lam * targets + (1 - lam) * targets[perm.to(targets.device)]
+            new_lengths = torch.maximum(new_lengths, new_lengths[perm])
+        return augmented, new_lengths, targets
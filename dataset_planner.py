@@ -0,0 +1,224 @@
+"""
+Balanced clip extraction in two steps: plan, then decode.
+
+The planner merges the events of every indexed match (annotation_index.py)
+and draws each label's clips across all leagues and seasons before any video
+is opened, instead of taking the first matches met in folder order until the
+folder holds 100 clips. The plan is a JSON file, and the extractor then opens
+only the halves that appear in it, each once, reading its clips in time order.
+
+Strategies:
+    stratified  each label's quota is split evenly over the (league, season)
+                pairs that have the label; pairs with fewer events hand their
+                share to the others
+    reservoir   uniform random sample of each label's events (reservoir sampling
+                while streaming over the matches)
+
+Example:
+    python dataset_planner.py plan --root videos --plan extraction_plan.json --update-index
+    python dataset_planner.py extract --root videos --plan extraction_plan.json --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from annotation_index import open_index
+from label_extraction import (DEFAULT_QUOTA, LABEL_QUOTAS, LabelQuota, clip_file_name, create_video_from_frames,
+                              extract_events_with_context, label_folder, read_frames)
+
+def candidate_events(index, context_time=5000, overlap_threshold=3000, **filters):
+    """Merged events of every indexed match, with league, season and match filled in"""
+    for league, season, match in index.matches(**filters):
+        data = index.match_data(league, season, match)
+        for event in extract_events_with_context(data, context_time, overlap_threshold):
+            event.update(league=league, season=season, match=match, folder=label_folder(event["label"]))
+            yield event
+
+def stratified_sample(events, quotas, default_quota, rng):
+    by_stratum = defaultdict(lambda: defaultdict(list))
+    for event in events:
+        by_stratum[event["folder"]][(event["league"], event["season"])].append(event)
+
+    selected = []
+    for folder, strata in sorted(by_stratum.items()):
+        quota = quotas.get(folder, default_quota)
+        pools = [strata[key] for key in sorted(strata)]
+        for pool in pools:
+            rng.shuffle(pool)
+        rng.shuffle(pools)
+
+        # Round-robin over the strata until the quota is met or every stratum is used up
+        taken = 0
+        while taken < quota and pools:
+            for pool in list(pools):
+                if taken == quota:
+                    break
+                selected.append(pool.pop())
+                taken += 1
+                if not pool:
+                    pools.remove(pool)
+    return selected
+
+def reservoir_sample(events, quotas, default_quota, rng):
+    reservoirs = defaultdict(list)
+    seen = Counter()
+    for event in events:
+        folder = event["folder"]
+        quota = quotas.get(folder, default_quota)
+        seen[folder] += 1
+        if len(reservoirs[folder]) < quota:
+            reservoirs[folder].append(event)
+        else:
+            slot = rng.randrange(seen[folder])
+            if slot < quota:
+                reservoirs[folder][slot] = event
+    return [event for reservoir in reservoirs.values() for event in reservoir]
+
+def build_plan(index, strategy='stratified', quotas=None, default_quota=DEFAULT_QUOTA,
+               context_time=5000, overlap_threshold=3000, seed=42, **filters):
+    """Extraction plan: the sampled clips ordered by league, season, match, half and start time"""
+    quotas = dict(LABEL_QUOTAS if quotas is None else quotas)
+    rng = random.Random(seed)
+    events = candidate_events(index, context_time, overlap_threshold, **filters)
+    if strategy == 'stratified':
+        selected = stratified_sample(events, quotas, default_quota, rng)
+    elif strategy == 'reservoir':
+        selected = reservoir_sample(events, quotas, default_quota, rng)
+    else:
+        raise ValueError(f"Unknown sampling strategy: {strategy}")
+
+    clips = sorted(({
+        "league": event["league"],
+        "season": event["season"],
+        "match": event["match"],
+        "half": event["half"],
+        "label": event["label"],
+        "folder": event["folder"],
+        "event_position": event["event_position"],
+        "start_time": event["start_time"],
+        "end_time": event["end_time"],
+        "index": event["index"]
+    } for event in selected), key=lambda clip: (clip["league"], clip["season"], clip["match"],
+                                               clip["half"], clip["start_time"]))
+    return {
+        "strategy": strategy,
+        "seed": seed,
+        "context_time": context_time,
+        "overlap_threshold": overlap_threshold,
+        "quotas": quotas,
+        "default_quota": default_quota,
+        "clips": clips
+    }
+
+def extract_half(video_path, clips, output_dir, quota):
+    """
+    Open one half once and write its clips in time order; returns the number written.
+    Each clip takes a slot from quota before it is decoded, so clips already in the
+    label folders (from label_extraction.py or an earlier plan) count towards it.
+    """
+    pending = []
+    for clip in clips:
+        output_video_path = os.path.join(output_dir, clip["folder"], clip_file_name(
+            clip["folder"], clip["half"], clip["event_position"], clip["index"]))
+        if not os.path.exists(output_video_path):
+            pending.append((clip, output_video_path))
+
+    video = None
+    written = 0
+    for clip, output_video_path in pending:
+        if not quota.reserve(clip["folder"]):
+            print(f"Skipping {os.path.basename(output_video_path)}, as {clip['folder']} already contains "
+                  f"{quota.limit(clip['folder'])} videos.")
+            continue
+
+        if video is None:
+            video = cv2.VideoCapture(video_path)
+            if not video.isOpened():
+                print(f"Error: Could not open video {video_path}")
+                quota.release(clip["folder"])
+                return written
+
+        frames = read_frames(video, clip["start_time"], clip["end_time"])
+        if frames:
+            os.makedirs(os.path.dirname(output_video_path), exist_ok=True)
+            create_video_from_frames(frames, output_video_path)
+            written += 1
+        else:
+            quota.release(clip["folder"])
+
+    if video is not None:
+        video.release()
+    return written
+
+def extract_plan(plan, root_path="videos", output_dir=None, workers=1):
+    output_dir = output_dir or os.path.join(root_path, "extracted")
+    halves = defaultdict(list)
+    for clip in plan["clips"]:
+        video_path = os.path.join(root_path, clip["league"], clip["season"], clip["match"], f"{clip['half']}_720p.mkv")
+        halves[video_path].append(clip)
+
+    missing = [video_path for video_path in halves if not os.path.exists(video_path)]
+    for video_path in missing:
+        print(f"Error: Video file {video_path} does not exist.")
+        del halves[video_path]
+
+    # Plan order is already file order: league, season, match, half
+    os.makedirs(output_dir, exist_ok=True)
+    if workers <= 1:
+        quota = LabelQuota(output_dir, plan["quotas"], plan["default_quota"])
+        written = sum(extract_half(video_path, clips, output_dir, quota) for video_path, clips in halves.items())
+    else:
+        # All workers reserve clips from the same counts
+        with multiprocessing.Manager() as manager:
+            quota = LabelQuota(output_dir, plan["quotas"], plan["default_quota"], manager=manager)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                written = sum(executor.map(extract_half, halves.keys(), halves.values(),
+                                           [output_dir] * len(halves), [quota] * len(halves)))
+    print(f"Wrote {written} clips from {len(halves)} halves")
+    return written
+
+def print_plan_summary(plan):
+    counts = Counter((clip["folder"], clip["league"]) for clip in plan["clips"])
+    halves = {(clip["league"], clip["season"], clip["match"], clip["half"]) for clip in plan["clips"]}
+    for (folder, league), count in sorted(counts.items()):
+        print(f"{folder} | {league}: {count}")
+    print(f"{len(plan['clips'])} clips from {len(halves)} halves")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plan a balanced clip dataset, then extract it")
+    parser.add_argument('command', choices=['plan', 'extract'])
+    parser.add_argument('--root', default='videos')
+    parser.add_argument('--index', default=None, help="Annotation index, defaults to <root>/annotations.sqlite")
+    parser.add_argument('--update-index', action='store_true', help="Pick up newly downloaded matches before planning")
+    parser.add_argument('--plan', default='extraction_plan.json')
+    parser.add_argument('--output-dir', default=None, help="Defaults to <root>/extracted")
+    parser.add_argument('--strategy', choices=['stratified', 'reservoir'], default='stratified')
+    parser.add_argument('--per-label', type=int, default=DEFAULT_QUOTA, help="Clips per label folder")
+    parser.add_argument('--context-time', type=int, default=5000)
+    parser.add_argument('--overlap-threshold', type=int, default=3000)
+    parser.add_argument('--league', nargs='+', default=None)
+    parser.add_argument('--season', nargs='+', default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help="Halves decoded in parallel")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'plan':
+        index = open_index(args.root, args.index, update=args.update_index)
+        plan = build_plan(index, args.strategy, default_quota=args.per_label, context_time=args.context_time,
+                          overlap_threshold=args.overlap_threshold, seed=args.seed,
+                          league=args.league, season=args.season)
+        with open(args.plan, 'w') as f:
+            json.dump(plan, f, indent=2)
+        print_plan_summary(plan)
+        print(f"Plan written to {args.plan}")
+    else:
+        with open(args.plan) as f:
+            plan = json.load(f)
+        extract_plan(plan, args.root, args.output_dir, args.workers)
@@ -0,0 +1,277 @@
+"""
+Distributed data-parallel training of the GRU models on cached features.
+
+Every process trains a replica on its shard of the training split, gradients are
+all-reduced after each backward pass and rank 0 writes the same best/final
+checkpoints as model_training.py. The gloo backend runs on CPU-only machines.
+
+Single node, 4 processes:
+    torchrun --nproc_per_node=4 distributed_training.py --features extracted_features2.5TR.pt
+
+Two nodes (run on each node with its own --node_rank):
+    torchrun --nnodes=2 --node_rank=0 --nproc_per_node=8 --master_addr=10.0.0.1 --master_port=29500 \
+        distributed_training.py --features extracted_features2.5TR.pt
+
+Local test without torchrun:
+    python distributed_training.py --features extracted_features2.5TR.pt --local-processes 4
+
+Rank 0 also writes <model>_gru_training_state.pth every --checkpoint-every epochs;
+pass it to --resume to continue an interrupted run with the same number of processes.
+"""
+
+import argparse
+import os
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset, TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+from data_pipeline import MemmapFeatureDataset, loader_kwargs, default_num_workers
+from temporal_models import AttentionEnhancedGRUModel, EnhancedGRUModel
+from training_utils import (AsyncCheckpointer, TrainingMonitor, capture_rng_state, restore_rng_state,
+                            training_state, load_training_state)
+
+# Checkpoint names used by model_training.py
+CHECKPOINT_NAMES = {
+    'attention': ('best_attention_enhanced_gru_model.pth', 'final_attention_enhanced_gru_model.pth'),
+    'enhanced': ('best_enhanced_gru_model.pth', 'final_enhanced_gru_model.pth')
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distributed training of the GRU models on cached features")
+    parser.add_argument('--features', default=r'D:\\FAI Project\\FAI_Data_Final\\extracted_features2.5TR.pt',
+                        help="Feature bundle written by resnet50_feature_extraction.py")
+    parser.add_argument('--memmap-dir', default=None,
+                        help="Directory written by data_pipeline.export_features_to_memmap (used instead of --features)")
+    parser.add_argument('--model', choices=['enhanced', 'attention'], default='enhanced')
+    parser.add_argument('--hidden-size', type=int, default=2048)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=16, help="Per-process batch size")
+    parser.add_argument('--lr', type=float, default=0.0001)
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--downsample-factor', type=int, default=1)
+    parser.add_argument('--downsample-mode', default='pool')
+    parser.add_argument('--seed', type=int, default=42, help="Shared by all ranks so they agree on the split")
+    parser.add_argument('--num-workers', type=int, default=0, help="DataLoader workers per process")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--backend', default=None, help="Defaults to gloo on CPU and nccl on CUDA")
+    parser.add_argument('--local-processes', type=int, default=0,
+                        help="Spawn this many local processes instead of being launched by torchrun")
+    parser.add_argument('--master-port', type=int, default=29500)
+    parser.add_argument('--checkpoint-every', type=int, default=1, help="Epochs between resumable training states")
+    parser.add_argument('--resume', default=None, help="Training state to continue from")
+    return parser.parse_args()
+
+def load_dataset(args):
+    if args.memmap_dir:
+        dataset = MemmapFeatureDataset(args.memmap_dir)
+        return dataset, dataset.shape, dataset.label_to_index, dataset.unique_labels
+
+    loaded_data = torch.load(args.features)
+    dataset = TensorDataset(loaded_data['features'], loaded_data['labels'])
+    return dataset, loaded_data['features'].shape, loaded_data['label_to_index'], loaded_data['unique_labels']
+
+def compute_loss(model_type, outputs, labels_batch, criterion):
+    if model_type == 'enhanced':
+        return criterion(outputs, labels_batch)
+
+    # Classification loss plus the confidence loss used in model_training.py
+    classification_loss = criterion(outputs['classification'], labels_batch)
+    confidence_loss = F.binary_cross_entropy(
+        outputs['confidence'].squeeze(1),
+        (outputs['classification'].argmax(1) == labels_batch).float()
+    )
+    return classification_loss + 0.1 * confidence_loss
+
+def reduce_mean(total, count, device):
+    """Average of a per-rank sum over every rank"""
+    stats = torch.tensor([total, count], dtype=torch.float64, device=device)
+    dist.all_reduce(stats, op=dist.ReduceOp.SUM)
+    return (stats[0] / stats[1]).item()
+
+def train(args):
+    rank = int(os.environ['RANK'])
+    world_size = int(os.environ['WORLD_SIZE'])
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+
+    if torch.cuda.is_available() and args.backend != 'gloo':
+        device = torch.device('cuda', local_rank)
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device('cpu')
+        # Split the node's cores between its processes instead of oversubscribing them
+        torch.set_num_threads(max(1, (default_num_workers(reserve=0) - args.num_workers * local_world_size)
+                                  // local_world_size))
+    backend = args.backend or ('nccl' if device.type == 'cuda' else 'gloo')
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+
+    full_dataset, feature_shape, label_to_index, unique_labels = load_dataset(args)
+
+    # Same permutation on every rank, so the train/validation split is identical everywhere
+    generator = torch.Generator().manual_seed(args.seed)
+    permutation = torch.randperm(len(full_dataset), generator=generator).tolist()
+    val_size = int(len(full_dataset) * args.validation_split)
+    train_dataset = Subset(full_dataset, permutation[val_size:])
+    # Validation is sharded without padding so the all-reduced loss covers each sample exactly once
+    val_dataset = Subset(full_dataset, permutation[:val_size][rank::world_size])
+
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                       shuffle=True, seed=args.seed)
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler,
+                              **loader_kwargs(device, num_workers=args.num_workers))
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size,
+                            **loader_kwargs(device, num_workers=args.num_workers))
+
+    input_size = feature_shape[2]
+    output_size = len(unique_labels)
+    torch.manual_seed(args.seed)
+    if args.model == 'enhanced':
+        model = EnhancedGRUModel(input_size, args.hidden_size, output_size,
+                                 downsample_factor=args.downsample_factor, downsample_mode=args.downsample_mode)
+    else:
+        model = AttentionEnhancedGRUModel(input_size, args.hidden_size, output_size,
+                                          downsample_factor=args.downsample_factor,
+                                          downsample_mode=args.downsample_mode)
+    model = model.to(device)
+    # DDP broadcasts rank 0's initial weights and all-reduces gradients during backward
+    ddp_model = DistributedDataParallel(model, device_ids=[local_rank] if device.type == 'cuda' else None)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(ddp_model.parameters(), lr=args.lr)
+
+    if rank == 0:
+        print(f"Training {args.model} GRU on {world_size} processes ({backend}), "
+              f"global batch size {args.batch_size * world_size}")
+
+    def checkpoint(loss):
+        # Same contents as the checkpoints written by model_training.py
+        state = {
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'loss': loss,
+            'label_to_index': label_to_index,
+            'unique_labels': unique_labels,
+            'input_size': input_size,
+            'output_size': output_size,
+            'downsample_factor': args.downsample_factor,
+            'downsample_mode': args.downsample_mode,
+            'hidden_size': args.hidden_size,
+            'num_layers': 3
+        }
+        if args.model == 'attention':
+            state.update({'temporal_head': 'gru', 'encoder_layers': 4, 'use_feature_reducer': False})
+        return state
+
+    best_path, final_path = [os.path.join(args.output_dir, name) for name in CHECKPOINT_NAMES[args.model]]
+    state_path = os.path.join(args.output_dir, f'{args.model}_gru_training_state.pth')
+    # Only rank 0 writes, off the training thread and via a temp file and an atomic rename
+    checkpointer = AsyncCheckpointer() if rank == 0 else None
+
+    # Per-step timings for every rank; all-reduce waits show up in backward
+    monitor = TrainingMonitor(os.path.join(args.output_dir, f'{args.model}_gru_metrics_rank{rank}.jsonl'), device,
+                              print_summary=rank == 0)
+
+    best_loss = float('inf')
+    start_epoch = 0
+    if args.resume:
+        # Every rank loads the same weights; each then restores its own RNG stream (dropout)
+        state = load_training_state(args.resume, model, optimizer, map_location=device)
+        if rank < len(state['rank_rng_states']):
+            restore_rng_state(state['rank_rng_states'][rank])
+        best_loss = state['best_loss']
+        start_epoch = state['epoch'] + 1
+        if rank == 0:
+            print(f"Resumed from {args.resume} after epoch {start_epoch}")
+
+    for epoch in range(start_epoch, args.epochs):
+        # Reshuffle the shards every epoch
+        train_sampler.set_epoch(epoch)
+
+        # Training phase
+        ddp_model.train()
+        total_train_loss, train_batches = 0, 0
+        monitor.start_epoch(epoch)
+        for features_batch, labels_batch in monitor.iterate(train_loader):
+            with monitor.phase('to_device'):
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+            with monitor.phase('optimizer'):
+                optimizer.zero_grad()
+            with monitor.phase('forward'):
+                loss = compute_loss(args.model, ddp_model(features_batch), labels_batch, criterion)
+            with monitor.phase('backward'):
+                loss.backward()
+            with monitor.phase('optimizer'):
+                optimizer.step()
+            total_train_loss += loss.item()
+            train_batches += 1
+            monitor.end_step(labels_batch.size(0))
+
+        # Validation phase (no gradients, so the unwrapped model is enough)
+        model.eval()
+        total_val_loss, val_samples = 0, 0
+        with torch.no_grad():
+            for features_batch, labels_batch in val_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                loss = compute_loss(args.model, model(features_batch), labels_batch, criterion)
+                total_val_loss += loss.item() * labels_batch.size(0)
+                val_samples += labels_batch.size(0)
+
+        avg_train_loss = reduce_mean(total_train_loss, train_batches, device)
+        avg_val_loss = reduce_mean(total_val_loss, val_samples, device)
+
+        if rank == 0:
+            print(f'Epoch [{epoch + 1}/{args.epochs}], Train Loss: {avg_train_loss:.4f}, '
+                  f'Validation Loss: {avg_val_loss:.4f}')
+
+            # Save the best model
+            if avg_val_loss < best_loss:
+                best_loss = avg_val_loss
+                checkpointer.save(checkpoint(best_loss), best_path)
+                print(f"Best model saved with validation loss: {best_loss:.4f}")
+
+        monitor.end_epoch(train_loss=avg_train_loss, val_loss=avg_val_loss)
+
+        # Resumable training state; the sampler only needs the epoch, RNG is collected from every rank
+        if (epoch + 1) % args.checkpoint_every == 0:
+            rank_rng_states = [None] * world_size
+            dist.all_gather_object(rank_rng_states, capture_rng_state())
+            if rank == 0:
+                checkpointer.save(training_state(epoch, model, optimizer, best_loss,
+                                                 rank_rng_states=rank_rng_states), state_path)
+
+    # Final model save
+    if rank == 0:
+        checkpointer.save(checkpoint(best_loss), final_path)
+        checkpointer.close()
+        print("Training completed. Models saved.")
+
+    monitor.close()
+    dist.barrier()
+    dist.destroy_process_group()
+
+def spawn_worker(local_rank, args):
+    os.environ.update({
+        'RANK': str(local_rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(args.local_processes),
+        'LOCAL_WORLD_SIZE': str(args.local_processes),
+        'MASTER_ADDR': '127.0.0.1',
+        'MASTER_PORT': str(args.master_port)
+    })
+    train(args)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.local_processes > 0:
+        mp.spawn(spawn_worker, args=(args,), nprocs=args.local_processes)
+    else:
+        # Launched by torchrun, which sets RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT
+        train(args)
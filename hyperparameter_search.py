@@ -0,0 +1,268 @@
+"""
+Parallel hyperparameter search over cached features.
+
+Trials run concurrently in separate processes that share the machine's cores,
+each trial reports its validation loss after every epoch, and a trial is
+pruned once its best validation loss is worse than the median of the other
+trials at the same epoch. Every trial's config, per-epoch losses, status and
+wall time are recorded in a local SQLite database.
+
+Targets:
+    enhanced  EnhancedGRUModel from temporal_models.py on a memmap directory
+              (--memmap-dir); a feature bundle (--features) is exported to one
+              once, before the trials start
+    resnet34  GRU head of GRUWithResNet from resnet34_and_gru_simultaneous.py on
+              the frozen-backbone caches in --cache-dir
+
+Example:
+    python hyperparameter_search.py --target enhanced --features extracted_features2.5TR.pt --trials 16 --parallel 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, random_split
+from data_pipeline import (CachedFeatureDataset, MemmapFeatureDataset, default_num_workers,
+                           export_features_to_memmap, pad_collate)
+from temporal_models import EnhancedGRUModel
+
+# Values tried for each of the constants at the top of the training sections
+SEARCH_SPACE = {
+    'hidden_size': [256, 512, 1024, 2048],
+    'learning_rate': [0.00003, 0.0001, 0.0003, 0.001],
+    'batch_size': [8, 16, 32],
+    'num_epochs': [20, 50]
+}
+
+# GRU head of GRUWithResNet (same layer names, so its weights load into the full model)
+class GRUHead(nn.Module):
+    def __init__(self, feature_size, hidden_size, output_size, num_layers=3, dropout=0.3):
+        super(GRUHead, self).__init__()
+        self.gru = nn.GRU(feature_size, hidden_size, num_layers=num_layers,
+                          batch_first=True, dropout=dropout)
+        self.fc = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size * 2),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size * 2, output_size)
+        )
+
+    def forward(self, features, lengths=None):
+        if lengths is not None:
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            return self.fc(hidden[-1])
+        gru_out, _ = self.gru(features)
+        return self.fc(gru_out[:, -1, :])
+
+class ResultsStore:
+    """SQLite file shared by the trial processes; every call opens its own short-lived connection"""
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS trials (
+                trial_id INTEGER PRIMARY KEY, search TEXT, config TEXT, status TEXT,
+                best_val_loss REAL, epochs_run INTEGER, wall_time REAL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS epochs (
+                trial_id INTEGER, epoch INTEGER, train_loss REAL, val_loss REAL,
+                PRIMARY KEY (trial_id, epoch))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def add_trial(self, search, config):
+        with self._connect() as db:
+            cursor = db.execute("INSERT INTO trials (search, config, status, epochs_run) VALUES (?, ?, 'running', 0)",
+                                (search, json.dumps(config)))
+            return cursor.lastrowid
+
+    def report_epoch(self, trial_id, epoch, train_loss, val_loss, best_val_loss):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO epochs VALUES (?, ?, ?, ?)", (trial_id, epoch, train_loss, val_loss))
+            db.execute("UPDATE trials SET best_val_loss = ?, epochs_run = ? WHERE trial_id = ?",
+                       (best_val_loss, epoch + 1, trial_id))
+
+    def finish_trial(self, trial_id, status, wall_time):
+        with self._connect() as db:
+            db.execute("UPDATE trials SET status = ?, wall_time = ? WHERE trial_id = ?", (status, wall_time, trial_id))
+
+    def best_losses_at_epoch(self, search, epoch, exclude_trial_id):
+        """Best validation loss up to `epoch` of every other trial of this search that got that far"""
+        with self._connect() as db:
+            rows = db.execute("""SELECT MIN(e.val_loss) FROM epochs e JOIN trials t ON e.trial_id = t.trial_id
+                                 WHERE t.search = ? AND e.trial_id != ? AND e.epoch <= ?
+                                 GROUP BY e.trial_id HAVING MAX(e.epoch) >= ?""",
+                              (search, exclude_trial_id, epoch, epoch)).fetchall()
+        return [row[0] for row in rows]
+
+    def results(self, search):
+        with self._connect() as db:
+            return db.execute("""SELECT trial_id, config, status, best_val_loss, epochs_run, wall_time FROM trials
+                                 WHERE search = ? ORDER BY best_val_loss IS NULL, best_val_loss""",
+                              (search,)).fetchall()
+
+def load_splits(args):
+    """Train/validation datasets, feature size and number of classes for the chosen target"""
+    if args.target == 'resnet34':
+        train_dataset = CachedFeatureDataset(os.path.join(args.cache_dir, 'train_features.pt'))
+        val_dataset = CachedFeatureDataset(os.path.join(args.cache_dir, 'val_features.pt'))
+        feature_size = train_dataset.features[0].shape[-1]
+        output_size = int(max(max(train_dataset.labels), max(val_dataset.labels))) + 1
+        return train_dataset, val_dataset, feature_size, output_size
+
+    # The parent exported the bundle once, every trial maps the same file
+    full_dataset = MemmapFeatureDataset(args.memmap_dir)
+    feature_shape = full_dataset.shape
+    output_size = len(full_dataset.unique_labels)
+
+    # Same seeded split for every trial so their validation losses are comparable
+    val_size = int(len(full_dataset) * args.validation_split)
+    train_dataset, val_dataset = random_split(full_dataset, [len(full_dataset) - val_size, val_size],
+                                              generator=torch.Generator().manual_seed(args.seed))
+    return train_dataset, val_dataset, feature_shape[2], output_size
+
+def run_trial(args, config, threads):
+    torch.set_num_threads(threads)
+    torch.manual_seed(args.seed)
+    store = ResultsStore(args.results)
+    trial_id = store.add_trial(args.search_name, config)
+    start_time = time.time()
+
+    # A trial that raises (out of memory, bad config, corrupt cache) is still recorded with its wall time
+    status = 'failed'
+    try:
+        status, epochs_run, best_val_loss = train_trial(args, config, store, trial_id)
+    finally:
+        wall_time = time.time() - start_time
+        store.finish_trial(trial_id, status, wall_time)
+    print(f"Trial {trial_id} {status} after {epochs_run} epochs in {wall_time:.0f}s: "
+          f"best validation loss {best_val_loss:.4f} with {config}")
+    return trial_id
+
+def train_trial(args, config, store, trial_id):
+    """Train one config, reporting every epoch to the store; returns (status, epochs run, best validation loss)"""
+    train_dataset, val_dataset, feature_size, output_size = load_splits(args)
+    # Clips in the resnet34 caches have different lengths and are padded per batch
+    collate = {'collate_fn': pad_collate} if args.target == 'resnet34' else {}
+    train_loader = DataLoader(train_dataset, batch_size=config['batch_size'], shuffle=True, **collate)
+    val_loader = DataLoader(val_dataset, batch_size=config['batch_size'], **collate)
+
+    if args.target == 'resnet34':
+        model = GRUHead(feature_size, config['hidden_size'], output_size)
+    else:
+        model = EnhancedGRUModel(feature_size, config['hidden_size'], output_size)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=config['learning_rate'])
+
+    def batches(loader):
+        for batch in loader:
+            if args.target == 'resnet34':
+                features_batch, lengths, labels_batch = batch[:3]
+                yield features_batch, lengths, labels_batch
+            else:
+                features_batch, labels_batch = batch
+                yield features_batch, None, labels_batch
+
+    best_val_loss = float('inf')
+    status = 'completed'
+    for epoch in range(config['num_epochs']):
+        # Training phase
+        model.train()
+        total_train_loss = 0
+        for features_batch, lengths, labels_batch in batches(train_loader):
+            optimizer.zero_grad()
+            loss = criterion(model(features_batch, lengths), labels_batch)
+            loss.backward()
+            optimizer.step()
+            total_train_loss += loss.item()
+
+        # Validation phase
+        model.eval()
+        total_val_loss = 0
+        with torch.no_grad():
+            for features_batch, lengths, labels_batch in batches(val_loader):
+                total_val_loss += criterion(model(features_batch, lengths), labels_batch).item()
+
+        avg_train_loss = total_train_loss / len(train_loader)
+        avg_val_loss = total_val_loss / len(val_loader)
+        best_val_loss = min(best_val_loss, avg_val_loss)
+        store.report_epoch(trial_id, epoch, avg_train_loss, avg_val_loss, best_val_loss)
+
+        # Median pruning: stop once this trial is worse than the median of its peers at this epoch
+        if epoch + 1 >= args.warmup_epochs:
+            peers = store.best_losses_at_epoch(args.search_name, epoch, trial_id)
+            if len(peers) >= args.min_peers and best_val_loss > statistics.median(peers):
+                status = 'pruned'
+                break
+
+    return status, epoch + 1, best_val_loss
+
+def prepare_memmap(args):
+    """Export the feature bundle to a memmap directory next to it, unless an up-to-date one exists"""
+    if args.target != 'enhanced' or args.memmap_dir:
+        return
+    args.memmap_dir = os.path.splitext(args.features)[0] + '_memmap'
+    meta_path = os.path.join(args.memmap_dir, 'meta.json')
+    if os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(args.features):
+        print(f"Using memmap features in {args.memmap_dir}")
+        return
+    export_features_to_memmap(args.features, args.memmap_dir)
+
+def sample_configs(num_trials, seed):
+    """Full grid when it is small enough, otherwise a random sample of it"""
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    if num_trials >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, num_trials)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter search with early pruning")
+    parser.add_argument('--target', choices=['enhanced', 'resnet34'], default='enhanced')
+    parser.add_argument('--features', default=r'D:\\FAI Project\\FAI_Data_Final\\extracted_features2.5TR.pt')
+    parser.add_argument('--memmap-dir', default=None)
+    parser.add_argument('--cache-dir', default='feature_cache')
+    parser.add_argument('--trials', type=int, default=16)
+    parser.add_argument('--parallel', type=int, default=4, help="Trials run at the same time")
+    parser.add_argument('--warmup-epochs', type=int, default=3, help="Epochs before a trial can be pruned")
+    parser.add_argument('--min-peers', type=int, default=2, help="Other trials needed at an epoch to prune")
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--results', default='hyperparameter_search.db')
+    parser.add_argument('--search-name', default=None, help="Groups trials in the results store")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.search_name is None:
+        args.search_name = f"{args.target}-{time.strftime('%Y%m%d-%H%M%S')}"
+    ResultsStore(args.results)
+    prepare_memmap(args)
+
+    configs = sample_configs(args.trials, args.seed)
+    # Split the cores evenly between the trials running at the same time
+    threads = max(1, default_num_workers(reserve=0) // args.parallel)
+    print(f"Search {args.search_name}: {len(configs)} trials, {args.parallel} at a time, {threads} threads each")
+
+    with ProcessPoolExecutor(max_workers=args.parallel, mp_context=mp.get_context('spawn')) as executor:
+        futures = [executor.submit(run_trial, args, config, threads) for config in configs]
+        for config, future in zip(configs, futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Trial with {config} failed: {e}")
+
+    print(f"\n{'trial':>5} | {'status':<9} | {'best val loss':>13} | {'epochs':>6} | {'wall (s)':>8} | config")
+    for trial_id, config, status, best_val_loss, epochs_run, wall_time in ResultsStore(args.results).results(args.search_name):
+        best_val_loss = f"{best_val_loss:.4f}" if best_val_loss is not None else '-'
+        wall_time = f"{wall_time:.0f}" if wall_time is not None else '-'
+        print(f"{trial_id:>5} | {status:<9} | {best_val_loss:>13} | {epochs_run:>6} | {wall_time:>8} | {config}")
@@ -1,6 +1,10 @@
 import os
-import json
+import bisect
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import cv2
+from annotation_index import open_index
 
 
 # Rankings of event labels
@@ -12,60 +16,136 @@ RANKINGS = {
     "Foul": 5,
 }
 
+# Clips kept per label folder; labels not listed here get DEFAULT_QUOTA
+DEFAULT_QUOTA = 100
+LABEL_QUOTAS = {}
+
 def count_videos_in_folder(folder_path):
     return sum(1 for file in os.listdir(folder_path) if file.endswith(".mp4"))
 
-def extract_events_with_context(data, context_time=5000, overlap_threshold=3000):
-    
-    events = []
+class LabelQuota:
+    """
+    Clips per label folder, counted once from output_dir and then tracked in
+    memory, so an event over its label's quota is rejected before any frames
+    are decoded.
+
+    With a multiprocessing Manager the counts and lock live in the manager
+    process and the quota can be passed to worker processes, which then
+    reserve slots from the same counts.
+    """
+    def __init__(self, output_dir, quotas=None, default_quota=DEFAULT_QUOTA, manager=None):
+        self.quotas = dict(LABEL_QUOTAS if quotas is None else quotas)
+        self.default_quota = default_quota
+        counts = {folder: count_videos_in_folder(os.path.join(output_dir, folder))
+                  for folder in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, folder))}
+        if manager is not None:
+            self.counts = manager.dict(counts)
+            self.lock = manager.Lock()
+        else:
+            self.counts = counts
+            self.lock = threading.Lock()
+
+    def limit(self, folder_name):
+        return self.quotas.get(folder_name, self.default_quota)
+
+    def reserve(self, folder_name):
+        """Take a slot for one more clip; False when the folder is already full"""
+        with self.lock:
+            count = self.counts.get(folder_name, 0)
+            if count >= self.limit(folder_name):
+                return False
+            self.counts[folder_name] = count + 1
+            return True
+
+    def release(self, folder_name):
+        """Give back a reserved slot whose clip was not written"""
+        with self.lock:
+            self.counts[folder_name] = self.counts.get(folder_name, 0) - 1
+
+# (context_time, overlap_threshold) pairs for the 2.5 s, 5 s and 10 s datasets
+CONTEXT_SETTINGS = [(2500, 1500), (5000, 3000), (10000, 6000)]
+
+class EventIndex:
+    """
+    Events kept for one (context_time, overlap_threshold) setting.
+
+    Per half, the kept events are held sorted by position, so an annotation
+    only looks at the kept events within overlap_threshold of it instead of
+    every kept event. When several are in range, the one kept first wins, and
+    it is replaced only by a better-ranked label, as in the original pairwise
+    scan, so the result is the same.
+    """
+    def __init__(self, context_time=5000, overlap_threshold=3000):
+        self.context_time = context_time
+        self.overlap_threshold = overlap_threshold
+        self.events = []
+        self.positions = {}  # half -> sorted [(event_position, index into self.events)]
+
+    def add(self, idx, event_label, event_position, game_time, half):
+        start_time = max(0, event_position - self.context_time)
+        end_time = event_position + self.context_time
+        label_rank = RANKINGS.get(event_label, 5)
 
+        positions = self.positions.setdefault(half, [])
+        lo = bisect.bisect_left(positions, (event_position - self.overlap_threshold, -1))
+        hi = bisect.bisect_right(positions, (event_position + self.overlap_threshold, float("inf")))
+
+        if lo < hi:
+            # Overlaps an event we already kept: keep whichever label ranks higher
+            match = min(range(lo, hi), key=lambda i: positions[i][1])
+            order = positions[match][1]
+            existing_event = self.events[order]
+            if label_rank < RANKINGS.get(existing_event["label"], 5):
+                existing_event.update({
+                    "label": event_label,
+                    "event_position": event_position,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "gameTime": game_time,
+                    "index": idx
+                })
+                del positions[match]
+                bisect.insort(positions, (event_position, order))
+            return
+
+        bisect.insort(positions, (event_position, len(self.events)))
+        self.events.append({
+            "label": event_label,
+            "event_position": event_position,
+            "start_time": start_time,
+            "end_time": end_time,
+            "gameTime": game_time,
+            "half": half,
+            "index": idx
+        })
+
+def parse_annotations(data):
+    """(index, label, position, gameTime, half) of every annotation, in file order"""
+    parsed = []
     for idx, annotation in enumerate(data["annotations"]):
-        event_label = annotation["label"]
-        event_position = int(annotation["position"])
         game_time = annotation["gameTime"]
-        half = game_time.split(" - ")[0]
-        start_time = max(0, event_position - context_time)
-        end_time = event_position + context_time
-        label_rank = RANKINGS.get(event_label, 5)
-
-        is_overlapping = False
-        for existing_event in events:
-            if existing_event["half"] == half:
-                if abs(existing_event["event_position"] - event_position) <= overlap_threshold:
-                    existing_rank = RANKINGS.get(existing_event["label"], 5)
-                    if label_rank < existing_rank:
-                        existing_event.update({
-                            "label": event_label,
-                            "event_position": event_position,
-                            "start_time": start_time,
-                            "end_time": end_time,
-                            "gameTime": game_time,
-                            "index": idx
-                        })
-                    is_overlapping = True
-                    break
-
-        if not is_overlapping:
-            events.append({
-                "label": event_label,
-                "event_position": event_position,
-                "start_time": start_time,
-                "end_time": end_time,
-                "gameTime": game_time,
-                "half": half,
-                "index": idx
-            })
-
-    return events
-
-
-def extract_frames_in_timeframe(video_path, start_time, end_time, frame_rate=30):
-    video = cv2.VideoCapture(video_path)
-
-    if not video.isOpened():
-        print(f"Error: Could not open video {video_path}")
-        return []
+        parsed.append((idx, annotation["label"], int(annotation["position"]), game_time, game_time.split(" - ")[0]))
+    return parsed
 
+def extract_events_with_context(data, context_time=5000, overlap_threshold=3000):
+    index = EventIndex(context_time, overlap_threshold)
+    for annotation in parse_annotations(data):
+        index.add(*annotation)
+    return index.events
+
+def extract_events_multi_context(data, settings=CONTEXT_SETTINGS):
+    """
+    Merged events for several (context_time, overlap_threshold) settings from a
+    single pass over the annotations; returns {setting: events}.
+    """
+    indexes = {setting: EventIndex(*setting) for setting in settings}
+    for annotation in parse_annotations(data):
+        for index in indexes.values():
+            index.add(*annotation)
+    return {setting: index.events for setting, index in indexes.items()}
+
+
+def read_frames(video, start_time, end_time, frame_rate=30):
     start_time_sec = start_time / 1000.0
     end_time_sec = end_time / 1000.0
 
@@ -87,6 +167,18 @@ def extract_frames_in_timeframe(video_path, start_time, end_time, frame_rate=30)
 
         frame_count += 1
 
+    return frames
+
+
+def extract_frames_in_timeframe(video_path, start_time, end_time, frame_rate=30):
+    video = cv2.VideoCapture(video_path)
+
+    if not video.isOpened():
+        print(f"Error: Could not open video {video_path}")
+        return []
+
+    frames = read_frames(video, start_time, end_time, frame_rate)
+
     video.release()
     return frames
 
@@ -108,9 +200,20 @@ def create_video_from_frames(frames, output_video_path, frame_rate=30):
     print(f"Video created at {output_video_path}")
 
 
-def extract_event_frames(data, video_path, output_dir, context_time=5000):
+def label_folder(event_label):
+    label_rank = RANKINGS.get(event_label, 5)  # Default rank to 5 if label is not in RANKINGS
+    return event_label if label_rank <= 5 else "nothing"
+
+
+def clip_file_name(folder_name, half, event_position, unique_index):
+    return f"{folder_name}_half_{half}_at_{event_position}_index_{unique_index}.mp4"
+
+
+def extract_event_frames(data, video_path, output_dir, context_time=5000, quota=None):
     events = extract_events_with_context(data, context_time)
     print(video_path)
+    if quota is None:
+        quota = LabelQuota(output_dir)
 
     for event in events:
         event_label = event["label"]
@@ -125,67 +228,72 @@ def extract_event_frames(data, video_path, output_dir, context_time=5000):
             print(f"Error: Video file {path} does not exist.")
             continue
 
-        label_rank = RANKINGS.get(event_label, 5)  # Default rank to 5 if label is not in RANKINGS
-        folder_name = event_label if label_rank <= 5 else "nothing"
+        folder_name = label_folder(event_label)
 
         # Create label-specific folder if not exists
         label_dir = os.path.join(output_dir, folder_name)
         if not os.path.exists(label_dir):
             os.makedirs(label_dir)
 
-        
-        video_count = count_videos_in_folder(label_dir)
-        if video_count >= 100:
-            print(f"Skipping frame extraction for {folder_name}, as it already contains {video_count} videos.")
-        else:
+        # A clip from an earlier run is already part of the folder's count
+        output_video_path = os.path.join(label_dir, clip_file_name(folder_name, half, event_position, unique_index))
+        if os.path.exists(output_video_path):
+            continue
+
+        if not quota.reserve(folder_name):
+            print(f"Skipping frame extraction for {folder_name}, as it already contains {quota.limit(folder_name)} videos.")
+            continue
+
         # Extract frames
-            frames = extract_frames_in_timeframe(path, start_time, end_time)
+        frames = extract_frames_in_timeframe(path, start_time, end_time)
 
-            # Create a video for the event
-            if frames:
-                output_video_path = os.path.join(label_dir, f"{folder_name}_half_{half}_at_{event_position}_index_{unique_index}.mp4")
-                create_video_from_frames(frames, output_video_path)
+        # Create a video for the event
+        if frames:
+            create_video_from_frames(frames, output_video_path)
+        else:
+            quota.release(folder_name)
 
     return events
 
 
-def process_league_videos(root_path):
-    for league in os.listdir(root_path):
-        league_path = os.path.join(root_path, league)
-        if not os.path.isdir(league_path):
-            continue
+def process_match(match_path, data, output_dir, quota):
+    # Extract frames and create videos
+    print(f"Processing match: {os.path.basename(match_path)}")
+    return extract_event_frames(data, match_path, output_dir, quota=quota)
 
-        for season in os.listdir(league_path):
-            season_path = os.path.join(league_path, season)
-            if not os.path.isdir(season_path):
-                continue
 
-            for match in os.listdir(season_path):
-                match_path = os.path.join(season_path, match)
-                if not os.path.isdir(match_path):
-                    continue
+def process_league_videos(root_path, index_path=None, refresh_index=False, workers=1,
+                          quotas=None, default_quota=DEFAULT_QUOTA):
+    # Matches and their annotations come from the annotation index, updated with new matches on every run
+    index = open_index(root_path, index_path, update=True, refresh=refresh_index)
 
-                # Load the JSON file
-                label_file_path = os.path.join(match_path, "Labels-v2.json")
-                if not os.path.exists(label_file_path):
-                    print(f"No label file found in {match_path}. Skipping...")
-                    continue
+    # Define output directory
+    output_dir = os.path.join(root_path, "extracted")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-                with open(label_file_path) as f:
-                    data = json.load(f)
+    matches = [(os.path.join(root_path, league, season, match), index.match_data(league, season, match))
+               for league, season, match in index.matches()]
 
-                # Define output directory
-                output_dir = os.path.join(root_path, "extracted")
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
+    if workers <= 1:
+        quota = LabelQuota(output_dir, quotas, default_quota)
+        for match_path, data in matches:
+            process_match(match_path, data, output_dir, quota)
+        return
 
-                # Extract frames and create videos
-                print(f"Processing match: {match}")
-                extract_event_frames(data, match_path, output_dir)
+    # Matches are decoded in parallel, all workers reserve clips from the same counts
+    with multiprocessing.Manager() as manager:
+        quota = LabelQuota(output_dir, quotas, default_quota, manager=manager)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_match, match_path, data, output_dir, quota)
+                       for match_path, data in matches]
+            for future in futures:
+                future.result()
 
 
-# Root path for the videos
-root_path = "videos"
+if __name__ == "__main__":
+    # Root path for the videos
+    root_path = "videos"
 
-# Process all league videos
-process_league_videos(root_path)
\ No newline at end of file
+    # Process all league videos
+    process_league_videos(root_path)
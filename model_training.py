@@ -13,73 +13,40 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import DataLoader, TensorDataset, RandomSampler
 import os
+from data_pipeline import loader_kwargs, BucketedBalancedBatchSampler
+from temporal_models import AttentionEnhancedGRUModel, TemporalEncoderModel
+from training_utils import AsyncCheckpointer, TrainingMonitor, training_state, load_training_state
 
 # Define the device based on CUDA availability
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"Using device: {device}")
 
-# Define an Attention-Enhanced GRU model
-class AttentionEnhancedGRUModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3):
-        super(AttentionEnhancedGRUModel, self).__init__()
-
-        # GRU Layers with Attention Mechanism
-        self.gru = nn.GRU(input_size, hidden_size, num_layers=num_layers,
-                          batch_first=True, dropout=dropout)
-
-        # Attention Mechanism
-        self.attention_layer = nn.Linear(hidden_size, 1)
-
-        # Fully Connected Layers for Classification
-        self.fc_classification = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size * 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size * 2, hidden_size),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size, output_size)
+# Prepare model function
+def prepare_model(input_size, hidden_size, output_size, downsample_factor=1, downsample_mode='pool',
+                  temporal_head='gru', encoder_layers=4):
+    if temporal_head == 'gru':
+        model = AttentionEnhancedGRUModel(
+            input_size=input_size,
+            hidden_size=hidden_size,
+            output_size=output_size,
+            downsample_factor=downsample_factor,
+            downsample_mode=downsample_mode
         )
-
-        # Confidence Score Layer
-        self.fc_confidence = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size // 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size // 2, 1),
-            nn.Sigmoid()  # Outputs a confidence score between 0 and 1
+    else:
+        # 'tcn' or 'transformer': same outputs, all timesteps processed in parallel
+        model = TemporalEncoderModel(
+            input_size=input_size,
+            hidden_size=hidden_size,
+            output_size=output_size,
+            encoder=temporal_head,
+            num_layers=encoder_layers,
+            use_feature_reducer=False,
+            downsample_factor=downsample_factor,
+            downsample_mode=downsample_mode
         )
-
-    def forward(self, x):
-        # GRU processing
-        gru_out, _ = self.gru(x)
-
-        # Attention Mechanism
-        attention_weights = F.softmax(self.attention_layer(gru_out), dim=1)
-        context_vector = torch.sum(gru_out * attention_weights, dim=1)
-
-        # Classification Output
-        classification_output = self.fc_classification(context_vector)
-
-        # Confidence Score Output
-        confidence_score = self.fc_confidence(context_vector)
-
-        return {
-            'classification': classification_output,
-            'confidence': confidence_score,
-            'attention_weights': attention_weights
-        }
-
-# Prepare model function
-def prepare_model(input_size, hidden_size, output_size):
-    model = AttentionEnhancedGRUModel(
-        input_size=input_size,
-        hidden_size=hidden_size,
-        output_size=output_size
-    ).to(device)
-    return model
+    return model.to(device)
 
 # Inference function
 def predict(model, input_data):
@@ -98,35 +65,42 @@ def predict(model, input_data):
             'attention_weights': outputs['attention_weights']
         }
 
-# Modified training loop
-def train_model(model, dataloader, criterion, optimizer, device):
+# Modified training loop (monitor times the data wait, copy, forward, backward and optimizer of every step)
+def train_model(model, dataloader, criterion, optimizer, device, monitor):
     model.train()
     total_loss = 0
 
-    for features_batch, labels_batch in dataloader:
-        features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+    for features_batch, labels_batch in monitor.iterate(dataloader):
+        with monitor.phase('to_device'):
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
 
-        optimizer.zero_grad()
+        with monitor.phase('optimizer'):
+            optimizer.zero_grad()
 
-        # Forward pass
-        outputs = model(features_batch)
+        with monitor.phase('forward'):
+            # Forward pass
+            outputs = model(features_batch)
 
-        # Calculate classification loss
-        classification_loss = criterion(outputs['classification'], labels_batch)
+            # Calculate classification loss
+            classification_loss = criterion(outputs['classification'], labels_batch)
 
-        # Optional: Add confidence loss
-        confidence_loss = F.binary_cross_entropy(
-            outputs['confidence'].squeeze(),
-            (outputs['classification'].argmax(1) == labels_batch).float()
-        )
+            # Optional: Add confidence loss
+            confidence_loss = F.binary_cross_entropy(
+                outputs['confidence'].squeeze(),
+                (outputs['classification'].argmax(1) == labels_batch).float()
+            )
 
-        # Combined loss
-        total_batch_loss = classification_loss + 0.1 * confidence_loss
+            # Combined loss
+            total_batch_loss = classification_loss + 0.1 * confidence_loss
 
-        total_batch_loss.backward()
-        optimizer.step()
+        with monitor.phase('backward'):
+            total_batch_loss.backward()
+
+        with monitor.phase('optimizer'):
+            optimizer.step()
 
         total_loss += total_batch_loss.item()
+        monitor.end_step(labels_batch.size(0))
 
     return total_loss
 
@@ -153,49 +127,99 @@ output_size = len(unique_labels)  # Set output size based on the number of uniqu
 num_epochs = 50  # Increased epochs for potentially better training
 batch_size = 16  # Adjusted batch size
 learning_rate = 0.0001
-
-# Prepare the dataset and dataloader
+downsample_factor = 1  # > 1 shortens each sequence by this factor before the GRU
+downsample_mode = 'pool'  # 'pool', 'conv' or 'stack' (see temporal_models.TemporalDownsampler)
+temporal_head = 'gru'  # 'gru', 'tcn' or 'transformer' (see temporal_models.TemporalEncoderModel)
+encoder_layers = 4  # Depth of the tcn/transformer encoder; hidden_size of 512 is plenty for these heads
+checkpoint_every = 1  # Epochs between resumable training-state checkpoints
+resume_path = None  # e.g. 'attention_enhanced_gru_training_state.pth' to continue an interrupted run
+balanced_batches = False  # Class-balanced batches instead of a plain shuffle
+
+# Prepare the dataset and dataloader (the sampler's own generator is checkpointed for resuming)
 dataset = TensorDataset(all_features, all_labels)
-dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+sampler_generator = torch.Generator().manual_seed(42)
+if balanced_batches:
+    dataloader = DataLoader(dataset, batch_sampler=BucketedBalancedBatchSampler(
+                                all_labels.tolist(), batch_size=batch_size, generator=sampler_generator),
+                            generator=torch.Generator(), **loader_kwargs(device))
+else:
+    dataloader = DataLoader(dataset, batch_size=batch_size,
+                            sampler=RandomSampler(dataset, generator=sampler_generator),
+                            generator=torch.Generator(), **loader_kwargs(device))
 
 # Instantiate the model, loss function, and optimizer
-model = prepare_model(input_size, hidden_size, output_size)
+model = prepare_model(input_size, hidden_size, output_size, downsample_factor, downsample_mode,
+                      temporal_head, encoder_layers)
 criterion = nn.CrossEntropyLoss()
 optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 
+# Checkpoints are written off the training thread, via a temp file and an atomic rename
+checkpointer = AsyncCheckpointer()
+state_path = 'attention_enhanced_gru_training_state.pth'
+
+# Per-step timings and epoch throughput summaries
+monitor = TrainingMonitor('attention_enhanced_gru_metrics.jsonl', device)
+
 # Training loop with validation tracking
 best_loss = float('inf')
-for epoch in range(num_epochs):
-    total_loss = train_model(model, dataloader, criterion, optimizer, device)
+start_epoch = 0
+if resume_path:
+    state = load_training_state(resume_path, model, optimizer, sampler_generator, map_location=device)
+    best_loss = state['best_loss']
+    start_epoch = state['epoch'] + 1
+    print(f"Resumed from {resume_path} after epoch {start_epoch}")
+
+for epoch in range(start_epoch, num_epochs):
+    monitor.start_epoch(epoch)
+    total_loss = train_model(model, dataloader, criterion, optimizer, device, monitor)
 
     # Calculate average loss for the epoch
     avg_loss = total_loss / len(dataloader)
     print(f'Epoch [{epoch + 1}/{num_epochs}], Average Loss: {avg_loss:.4f}')
+    monitor.end_epoch(train_loss=avg_loss)
 
     # Save the best model
     if avg_loss < best_loss:
         best_loss = avg_loss
-        torch.save({
+        checkpointer.save({
             'model_state_dict': model.state_dict(),
             'optimizer_state_dict': optimizer.state_dict(),
             'loss': best_loss,
             'label_to_index': label_to_index,
             'unique_labels': unique_labels,
             'input_size': input_size,
-            'output_size': output_size
+            'output_size': output_size,
+            'downsample_factor': downsample_factor,
+            'downsample_mode': downsample_mode,
+            'temporal_head': temporal_head,
+            'hidden_size': hidden_size,
+            'encoder_layers': encoder_layers,
+            'use_feature_reducer': False
         }, 'best_attention_enhanced_gru_model.pth')
         print(f"Best model saved with loss: {best_loss:.4f}")
 
+    # Resumable training state
+    if (epoch + 1) % checkpoint_every == 0:
+        checkpointer.save(training_state(epoch, model, optimizer, best_loss, sampler_generator), state_path)
+
 # Final model save
-torch.save({
+checkpointer.save({
     'model_state_dict': model.state_dict(),
     'optimizer_state_dict': optimizer.state_dict(),
     'loss': best_loss,
     'label_to_index': label_to_index,
     'unique_labels': unique_labels,
     'input_size': input_size,
-    'output_size': output_size
+    'output_size': output_size,
+    'downsample_factor': downsample_factor,
+    'downsample_mode': downsample_mode,
+    'temporal_head': temporal_head,
+    'hidden_size': hidden_size,
+    'encoder_layers': encoder_layers,
+    'use_feature_reducer': False
 }, 'final_attention_enhanced_gru_model.pth')
+checkpointer.close()
+monitor.close()
 
 print("Training completed. Models saved.")
 
@@ -204,111 +228,151 @@ print("Training completed. Models saved.")
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset, random_split
+from torch.utils.data import DataLoader, TensorDataset, RandomSampler, random_split
 import os
 import matplotlib.pyplot as plt
+from data_pipeline import MemmapFeatureDataset, loader_kwargs, BucketedBalancedBatchSampler, FeatureAugmenter
+from temporal_models import EnhancedGRUModel
+from training_utils import AsyncCheckpointer, TrainingMonitor, training_state, load_training_state
 
 # Define the device based on CUDA availability
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"Using device: {device}")
 
-# Define an enhanced GRU model with more layers and dropout
-class EnhancedGRUModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3):
-        super(EnhancedGRUModel, self).__init__()
-
-        # Add multiple GRU layers
-        self.gru = nn.GRU(input_size, hidden_size, num_layers=num_layers, batch_first=True, dropout=dropout)
-
-        # Fully connected layers with increased hidden size
-        self.fc1 = nn.Linear(hidden_size, hidden_size * 2)  # Increase the size of the first FC layer
-        self.fc2 = nn.Linear(hidden_size * 2, hidden_size)  # Keep the second layer the same size
-        self.fc3 = nn.Linear(hidden_size, output_size)  # Final output layer
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(dropout)  # Dropout layer
-
-    def forward(self, x):
-        out, _ = self.gru(x)
-        out = out[:, -1, :]  # Take the output from the last time step
-        out = self.fc1(out)
-        out = self.relu(out)
-        out = self.dropout(out)  # Apply dropout
-        out = self.fc2(out)
-        out = self.relu(out)
-        out = self.dropout(out)  # Apply dropout again
-        return self.fc3(out)
-
 # Load the previously extracted features
 features_path = r'D:\\FAI Project\\FAI_Data_Final\\extracted_features2.5TR.pt'
-loaded_data = torch.load(features_path)
 
-# Extract features and labels
-all_features = loaded_data['features']
-all_labels = loaded_data['labels']
-label_to_index = loaded_data['label_to_index']
-unique_labels = loaded_data['unique_labels']
+# Directory written by data_pipeline.export_features_to_memmap; when set, features
+# stay on disk and are paged in per batch instead of being loaded into RAM
+memmap_dir = None
+
+if memmap_dir:
+    full_dataset = MemmapFeatureDataset(memmap_dir)
+    feature_shape = full_dataset.shape
+    label_to_index = full_dataset.label_to_index
+    unique_labels = full_dataset.unique_labels
+    print("Memory-mapped Features Shape:", feature_shape)
+else:
+    loaded_data = torch.load(features_path)
+
+    # Extract features and labels
+    all_features = loaded_data['features']
+    all_labels = loaded_data['labels']
+    label_to_index = loaded_data['label_to_index']
+    unique_labels = loaded_data['unique_labels']
+    full_dataset = TensorDataset(all_features, all_labels)
+    feature_shape = all_features.shape
+
+    print("Loaded Features Shape:", all_features.shape)
+    print("Loaded Labels Shape:", all_labels.shape)
 
 # Print some information about the dataset
-print("Loaded Features Shape:", all_features.shape)
-print("Loaded Labels Shape:", all_labels.shape)
 print("Unique Labels:", unique_labels)
 print("Label to Index Mapping:", label_to_index)
 
 # Hyperparameters
-input_size = all_features.shape[2]  # Feature vector size
+input_size = feature_shape[2]  # Feature vector size
 hidden_size = 2048  # Increased hidden size for better representation
 output_size = len(unique_labels)  # Set output size based on the number of unique labels
 num_epochs = 50  # Increased epochs for potentially better training
 batch_size = 16  # Adjusted batch size
 learning_rate = 0.0001
 validation_split = 0.2  # 20% of data for validation
+downsample_factor = 1  # > 1 shortens each sequence by this factor before the GRU
+downsample_mode = 'pool'  # 'pool', 'conv' or 'stack' (see temporal_models.TemporalDownsampler)
+checkpoint_every = 1  # Epochs between resumable training-state checkpoints
+resume_path = None  # e.g. 'enhanced_gru_training_state.pth' to continue an interrupted run
+balanced_batches = False  # Class-balanced batches instead of a plain shuffle
+augment_features = False  # Temporal crop/jitter, speed resampling and mixup on the cached features
 
 # Split the dataset into training and validation sets
-total_size = len(all_features)
+total_size = len(full_dataset)
 val_size = int(total_size * validation_split)
 train_size = total_size - val_size
 
-# Create datasets and dataloaders
-full_dataset = TensorDataset(all_features, all_labels)
-train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
-
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=batch_size)
+# Create datasets and dataloaders (random_split only stores indices, nothing is copied).
+# The split is seeded so a resumed run validates on the same samples.
+train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size],
+                                          generator=torch.Generator().manual_seed(42))
+
+sampler_generator = torch.Generator().manual_seed(42)
+if balanced_batches:
+    # Labels of the training subset, in subset order; the features are never touched
+    full_labels = full_dataset.labels if memmap_dir else all_labels.numpy()
+    train_loader = DataLoader(train_dataset, batch_sampler=BucketedBalancedBatchSampler(
+                                  full_labels[train_dataset.indices], batch_size=batch_size,
+                                  generator=sampler_generator),
+                              generator=torch.Generator(), **loader_kwargs(device))
+else:
+    train_loader = DataLoader(train_dataset, batch_size=batch_size,
+                              sampler=RandomSampler(train_dataset, generator=sampler_generator),
+                              generator=torch.Generator(), **loader_kwargs(device))
+val_loader = DataLoader(val_dataset, batch_size=batch_size, **loader_kwargs(device))
 
 # Instantiate the model, loss function, and optimizer
-model = EnhancedGRUModel(input_size, hidden_size, output_size).to(device)
+model = EnhancedGRUModel(input_size, hidden_size, output_size, downsample_factor=downsample_factor,
+                         downsample_mode=downsample_mode).to(device)
 criterion = nn.CrossEntropyLoss()
+augmenter = FeatureAugmenter()
 optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 
 # Lists to store loss values for plotting
 train_losses = []
 val_losses = []
 
+# Checkpoints are written off the training thread, via a temp file and an atomic rename
+checkpointer = AsyncCheckpointer()
+state_path = 'enhanced_gru_training_state.pth'
+
+# Per-step timings and epoch throughput summaries
+monitor = TrainingMonitor('enhanced_gru_metrics.jsonl', device)
+
 # Training loop with validation tracking
 best_loss = float('inf')
-for epoch in range(num_epochs):
+start_epoch = 0
+if resume_path:
+    state = load_training_state(resume_path, model, optimizer, sampler_generator, map_location=device)
+    best_loss = state['best_loss']
+    train_losses = state['train_losses']
+    val_losses = state['val_losses']
+    start_epoch = state['epoch'] + 1
+    print(f"Resumed from {resume_path} after epoch {start_epoch}")
+
+for epoch in range(start_epoch, num_epochs):
     # Training phase
     model.train()
     total_train_loss = 0
+    monitor.start_epoch(epoch)
 
-    for features_batch, labels_batch in train_loader:
+    for features_batch, labels_batch in monitor.iterate(train_loader):
         # Move data to GPU
-        features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+        with monitor.phase('to_device'):
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
 
         # Zero gradients
-        optimizer.zero_grad()
-
-        # Forward pass
-        outputs = model(features_batch)
+        with monitor.phase('optimizer'):
+            optimizer.zero_grad()
+
+        with monitor.phase('forward'):
+            # Forward pass (augmented clips may be cropped, so their lengths are passed along)
+            if augment_features:
+                features_batch, lengths, targets = augmenter(features_batch, labels_batch, output_size)
+                outputs = model(features_batch, lengths)
+            else:
+                outputs = model(features_batch)
+                targets = labels_batch
 
-        # Calculate loss
-        loss = criterion(outputs, labels_batch)
+            # Calculate loss (targets are soft labels when mixup is on)
+            loss = criterion(outputs, targets)
 
         # Backward pass and optimization
-        loss.backward()
-        optimizer.step()
+        with monitor.phase('backward'):
+            loss.backward()
+        with monitor.phase('optimizer'):
+            optimizer.step()
 
         total_train_loss += loss.item()
+        monitor.end_step(labels_batch.size(0))
 
     # Validation phase
     model.eval()
@@ -334,99 +398,532 @@ for epoch in range(num_epochs):
     val_losses.append(avg_val_loss)
 
     print(f'Epoch [{epoch + 1}/{num_epochs}], Train Loss: {avg_train_loss:.4f}, Validation Loss: {avg_val_loss:.4f}')
+    monitor.end_epoch(train_loss=avg_train_loss, val_loss=avg_val_loss)
 
     # Save the best model
     if avg_val_loss < best_loss:
         best_loss = avg_val_loss
-        torch.save({
+        checkpointer.save({
             'model_state_dict': model.state_dict(),
             'optimizer_state_dict': optimizer.state_dict(),
             'loss': best_loss,
             'label_to_index': label_to_index,
             'unique_labels': unique_labels,
             'input_size': input_size,
-            'output_size': output_size
+            'output_size': output_size,
+            'downsample_factor': downsample_factor,
+            'downsample_mode': downsample_mode,
+            'hidden_size': hidden_size,
+            'num_layers': 3,
+            'use_feature_reducer': False
         }, 'best_enhanced_gru_model.pth')
         print(f"Best model saved with validation loss: {best_loss:.4f}")
 
+    # Resumable training state
+    if (epoch + 1) % checkpoint_every == 0:
+        checkpointer.save(training_state(epoch, model, optimizer, best_loss, sampler_generator,
+                                         train_losses=train_losses, val_losses=val_losses), state_path)
+
 # Final model save
-torch.save({
+checkpointer.save({
     'model_state_dict': model.state_dict(),
     'optimizer_state_dict': optimizer.state_dict(),
     'loss': best_loss,
     'label_to_index': label_to_index,
     'unique_labels': unique_labels,
     'input_size': input_size,
-    'output_size': output_size
+    'output_size': output_size,
+    'downsample_factor': downsample_factor,
+    'downsample_mode': downsample_mode,
+    'hidden_size': hidden_size,
+    'num_layers': 3,
+    'use_feature_reducer': False
 }, 'final_enhanced_gru_model.pth')
+checkpointer.close()
+monitor.close()
 
 print("Training completed. Models and loss plot saved.")
 
-"""# Predition on a Single Test video using the Saved Model"""
+"""# Temporal Downsampling Comparison (Accuracy and Latency on the Validation Split)"""
 
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-import cv2
-import numpy as np
-import torchvision.models as models
+from temporal_models import measure_latency
 
-# Attention-Enhanced GRU Model
-class AttentionEnhancedGRUModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3):
-        super(AttentionEnhancedGRUModel, self).__init__()
-
-        # GRU Layers with Attention Mechanism
-        self.gru = nn.GRU(input_size, hidden_size, num_layers=num_layers,
-                          batch_first=True, dropout=dropout)
-
-        # Attention Mechanism
-        self.attention_layer = nn.Linear(hidden_size, 1)
-
-        # Fully Connected Layers for Classification
-        self.fc_classification = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size * 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size * 2, hidden_size),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size, output_size)
-        )
+# Trains one model per setting on the split above; enable when comparing front-ends
+run_downsampling_comparison = False
+comparison_epochs = 10
+downsampling_configs = [(1, 'pool'), (2, 'pool'), (4, 'pool'), (4, 'conv'), (4, 'stack')]
 
-        # Confidence Score Layer
-        self.fc_confidence = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size // 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size // 2, 1),
-            nn.Sigmoid()  # Outputs a confidence score between 0 and 1
-        )
+def evaluate_accuracy(model, loader):
+    model.eval()
+    correct, total = 0, 0
+    with torch.no_grad():
+        for features_batch, labels_batch in loader:
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+            outputs = model(features_batch)
+            if isinstance(outputs, dict):
+                outputs = outputs['classification']
+            predictions = torch.argmax(outputs, dim=1)
+            correct += (predictions == labels_batch).sum().item()
+            total += labels_batch.size(0)
+    return correct / total
+
+if run_downsampling_comparison:
+    comparison_results = []
+    for factor, mode in downsampling_configs:
+        torch.manual_seed(0)
+        candidate = EnhancedGRUModel(input_size, hidden_size, output_size,
+                                     downsample_factor=factor, downsample_mode=mode).to(device)
+        candidate_optimizer = optim.Adam(candidate.parameters(), lr=learning_rate)
+
+        for epoch in range(comparison_epochs):
+            candidate.train()
+            for features_batch, labels_batch in train_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                candidate_optimizer.zero_grad()
+                loss = criterion(candidate(features_batch), labels_batch)
+                loss.backward()
+                candidate_optimizer.step()
+
+        accuracy = evaluate_accuracy(candidate, val_loader)
+        latency_ms = measure_latency(candidate, input_size, feature_shape[1], device=device)
+        comparison_results.append((factor, mode, accuracy, latency_ms))
+
+    print(f"{'factor':>6} | {'mode':<5} | {'val acc':>7} | {'latency (ms/clip)':>17}")
+    for factor, mode, accuracy, latency_ms in comparison_results:
+        print(f"{factor:>6} | {mode:<5} | {accuracy:>7.4f} | {latency_ms:>17.1f}")
+
+"""# Temporal Head Comparison (GRU vs Parallel-in-Time Encoders)"""
+
+from temporal_models import TemporalEncoderModel
+
+# Trains each head on the same split and reports accuracy and inference throughput
+run_head_comparison = False
+head_hidden_size = 512
+throughput_batch_size = 32
+head_configs = ['gru', 'tcn', 'transformer']
+
+if run_head_comparison:
+    head_results = []
+    for head in head_configs:
+        torch.manual_seed(0)
+        if head == 'gru':
+            candidate = AttentionEnhancedGRUModel(input_size, head_hidden_size, output_size).to(device)
+        else:
+            candidate = TemporalEncoderModel(input_size, head_hidden_size, output_size, encoder=head,
+                                             use_feature_reducer=False).to(device)
+        candidate_optimizer = optim.Adam(candidate.parameters(), lr=learning_rate)
+
+        for epoch in range(comparison_epochs):
+            candidate.train()
+            for features_batch, labels_batch in train_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                candidate_optimizer.zero_grad()
+                loss = criterion(candidate(features_batch)['classification'], labels_batch)
+                loss.backward()
+                candidate_optimizer.step()
+
+        accuracy = evaluate_accuracy(candidate, val_loader)
+        latency_ms = measure_latency(candidate, input_size, feature_shape[1],
+                                     batch_size=throughput_batch_size, device=device)
+        head_results.append((head, accuracy, throughput_batch_size * 1000 / latency_ms))
+
+    print(f"{'head':<11} | {'val acc':>7} | {'throughput (clips/s)':>20}")
+    for head, accuracy, clips_per_second in head_results:
+        print(f"{head:<11} | {accuracy:>7.4f} | {clips_per_second:>20.1f}")
+
+"""# Distillation of the Enhanced GRU into a Compact Student (CPU Inference)"""
+
+import io
+import json
+import torch.nn.functional as F
 
-    def forward(self, x):
-        # Ensure input is 3D (batch, sequence, features)
-        if x.dim() == 4:
-            # If 4D, reshape to flatten spatial dimensions
-            x = x.view(x.size(0), x.size(1), -1)
+# Trains a small EnhancedGRUModel to match the 2048-hidden teacher on the split above
+run_distillation = False
+teacher_path = 'final_enhanced_gru_model.pth'
+student_path = 'student_enhanced_gru_model.pth'
+student_hidden_size = 512
+student_num_layers = 2
+distillation_epochs = 30
+distillation_temperature = 4.0
+distillation_alpha = 0.7  # Weight of the soft teacher targets vs. the hard labels
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature, alpha):
+    # KL between softened distributions, scaled by T^2 so its gradients match the hard loss
+    soft_loss = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction='batchmean'
+    ) * temperature ** 2
+    hard_loss = F.cross_entropy(student_logits, labels)
+    return alpha * soft_loss + (1 - alpha) * hard_loss
+
+def model_footprint(model):
+    """Parameter count and serialized state_dict size in MB"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return sum(p.numel() for p in model.parameters()), buffer.tell() / 1024 ** 2
+
+if run_distillation:
+    teacher_checkpoint = torch.load(teacher_path, map_location=device)
+    teacher = EnhancedGRUModel(
+        teacher_checkpoint['input_size'],
+        teacher_checkpoint.get('hidden_size', 2048),
+        teacher_checkpoint['output_size'],
+        num_layers=teacher_checkpoint.get('num_layers', 3),
+        downsample_factor=teacher_checkpoint.get('downsample_factor', 1),
+        downsample_mode=teacher_checkpoint.get('downsample_mode', 'pool')
+    ).to(device)
+    teacher.load_state_dict(teacher_checkpoint['model_state_dict'])
+    teacher.eval()
+
+    torch.manual_seed(0)
+    student = EnhancedGRUModel(
+        input_size, student_hidden_size, output_size, num_layers=student_num_layers,
+        downsample_factor=teacher_checkpoint.get('downsample_factor', 1),
+        downsample_mode=teacher_checkpoint.get('downsample_mode', 'pool')
+    ).to(device)
+    student_optimizer = optim.Adam(student.parameters(), lr=learning_rate * 10)
 
-        # GRU processing
-        gru_out, _ = self.gru(x)
+    best_student_loss = float('inf')
+    for epoch in range(distillation_epochs):
+        student.train()
+        total_distill_loss = 0
+        for features_batch, labels_batch in train_loader:
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+            with torch.no_grad():
+                teacher_logits = teacher(features_batch)
+
+            student_optimizer.zero_grad()
+            loss = distillation_loss(student(features_batch), teacher_logits, labels_batch,
+                                     distillation_temperature, distillation_alpha)
+            loss.backward()
+            student_optimizer.step()
+            total_distill_loss += loss.item()
+
+        # Select the student on plain validation cross-entropy, like the teacher
+        student.eval()
+        total_val_loss = 0
+        with torch.no_grad():
+            for features_batch, labels_batch in val_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                total_val_loss += criterion(student(features_batch), labels_batch).item()
+        avg_val_loss = total_val_loss / len(val_loader)
+        print(f'Epoch [{epoch + 1}/{distillation_epochs}], Distillation Loss: {total_distill_loss / len(train_loader):.4f}, '
+              f'Validation Loss: {avg_val_loss:.4f}')
+
+        # Same checkpoint format as the teacher, plus the student's architecture
+        if avg_val_loss < best_student_loss:
+            best_student_loss = avg_val_loss
+            torch.save({
+                'model_state_dict': student.state_dict(),
+                'optimizer_state_dict': student_optimizer.state_dict(),
+                'loss': best_student_loss,
+                'label_to_index': label_to_index,
+                'unique_labels': unique_labels,
+                'input_size': input_size,
+                'output_size': output_size,
+                'downsample_factor': teacher_checkpoint.get('downsample_factor', 1),
+                'downsample_mode': teacher_checkpoint.get('downsample_mode', 'pool'),
+                'hidden_size': student_hidden_size,
+                'num_layers': student_num_layers,
+                'use_feature_reducer': False,
+                'distilled_from': teacher_path
+            }, student_path)
+
+    student.load_state_dict(torch.load(student_path, map_location=device)['model_state_dict'])
+
+    # Size / latency / accuracy report; latency is measured on CPU, where the student is meant to run
+    report = {}
+    for name, candidate in [('teacher', teacher), ('student', student)]:
+        parameters, size_mb = model_footprint(candidate)
+        accuracy = evaluate_accuracy(candidate, val_loader)
+        candidate_cpu = candidate.to('cpu')
+        latency_ms = measure_latency(candidate_cpu, input_size, feature_shape[1])
+        batch_latency_ms = measure_latency(candidate_cpu, input_size, feature_shape[1], batch_size=32)
+        candidate.to(device)
+        report[name] = {
+            'parameters': parameters,
+            'size_mb': round(size_mb, 2),
+            'val_accuracy': round(accuracy, 4),
+            'cpu_latency_ms': round(latency_ms, 2),
+            'cpu_clips_per_second_batch32': round(32 * 1000 / batch_latency_ms, 1)
+        }
 
-        # Attention Mechanism
-        attention_weights = F.softmax(self.attention_layer(gru_out), dim=1)
-        context_vector = torch.sum(gru_out * attention_weights, dim=1)
+    print(f"{'model':<8} | {'params':>11} | {'size (MB)':>9} | {'val acc':>7} | {'ms/clip':>7} | {'clips/s @32':>11}")
+    for name, row in report.items():
+        print(f"{name:<8} | {row['parameters']:>11,} | {row['size_mb']:>9.1f} | {row['val_accuracy']:>7.4f} | "
+              f"{row['cpu_latency_ms']:>7.1f} | {row['cpu_clips_per_second_batch32']:>11.1f}")
+
+    with open('distillation_report.json', 'w') as f:
+        json.dump(report, f, indent=4)
+
+"""# Compression of the Enhanced GRU (GRU Pruning + Low-Rank fc1/fc2)"""
+
+from temporal_models import compress_enhanced_gru
+
+# Prunes GRU hidden units, factorizes fc1/fc2, then fine-tunes on the split above
+run_compression = False
+compression_source_path = 'final_enhanced_gru_model.pth'
+compressed_path = 'compressed_enhanced_gru_model.pth'
+compressed_gru_hidden_size = 1024  # None keeps every GRU hidden unit
+compressed_fc_rank = 256  # None keeps fc1/fc2 dense
+compression_finetune_epochs = 10
+
+if run_compression:
+    source_checkpoint = torch.load(compression_source_path, map_location=device)
+    compressed = EnhancedGRUModel(
+        source_checkpoint['input_size'],
+        source_checkpoint.get('hidden_size', 2048),
+        source_checkpoint['output_size'],
+        num_layers=source_checkpoint.get('num_layers', 3),
+        downsample_factor=source_checkpoint.get('downsample_factor', 1),
+        downsample_mode=source_checkpoint.get('downsample_mode', 'pool')
+    ).to(device)
+    compressed.load_state_dict(source_checkpoint['model_state_dict'])
+    original_parameters, original_size_mb = model_footprint(compressed)
+    original_accuracy = evaluate_accuracy(compressed, val_loader)
+    original_latency_ms = measure_latency(compressed.to('cpu'), input_size, feature_shape[1])
+    compressed.to(device)
+
+    compressed = compress_enhanced_gru(compressed, compressed_gru_hidden_size, compressed_fc_rank)
+    print(f"Accuracy right after compression: {evaluate_accuracy(compressed, val_loader):.4f}")
+
+    # Short fine-tune to recover what pruning and truncation lost
+    finetune_optimizer = optim.Adam(compressed.parameters(), lr=learning_rate)
+    best_compressed_loss = float('inf')
+    for epoch in range(compression_finetune_epochs):
+        compressed.train()
+        for features_batch, labels_batch in train_loader:
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+            finetune_optimizer.zero_grad()
+            loss = criterion(compressed(features_batch), labels_batch)
+            loss.backward()
+            finetune_optimizer.step()
 
-        # Classification Output
-        classification_output = self.fc_classification(context_vector)
+        compressed.eval()
+        total_val_loss = 0
+        with torch.no_grad():
+            for features_batch, labels_batch in val_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                total_val_loss += criterion(compressed(features_batch), labels_batch).item()
+        avg_val_loss = total_val_loss / len(val_loader)
+        print(f'Epoch [{epoch + 1}/{compression_finetune_epochs}], Validation Loss: {avg_val_loss:.4f}')
+
+        # Same checkpoint format; 'compression' tells loaders how to rebuild the smaller layers
+        if avg_val_loss < best_compressed_loss:
+            best_compressed_loss = avg_val_loss
+            torch.save({
+                'model_state_dict': compressed.state_dict(),
+                'optimizer_state_dict': finetune_optimizer.state_dict(),
+                'loss': best_compressed_loss,
+                'label_to_index': label_to_index,
+                'unique_labels': unique_labels,
+                'input_size': source_checkpoint['input_size'],
+                'output_size': source_checkpoint['output_size'],
+                'downsample_factor': source_checkpoint.get('downsample_factor', 1),
+                'downsample_mode': source_checkpoint.get('downsample_mode', 'pool'),
+                'hidden_size': source_checkpoint.get('hidden_size', 2048),
+                'num_layers': source_checkpoint.get('num_layers', 3),
+                'use_feature_reducer': False,
+                'compression': {
+                    'gru_hidden_size': compressed_gru_hidden_size,
+                    'fc_rank': compressed_fc_rank
+                }
+            }, compressed_path)
+
+    compressed.load_state_dict(torch.load(compressed_path, map_location=device)['model_state_dict'])
+
+    # Latency and memory benchmark on CPU, where the replicas are packed
+    compressed_parameters, compressed_size_mb = model_footprint(compressed)
+    compressed_accuracy = evaluate_accuracy(compressed, val_loader)
+    compressed_latency_ms = measure_latency(compressed.to('cpu'), input_size, feature_shape[1])
+    compressed.to(device)
+
+    print(f"{'model':<10} | {'params':>11} | {'weights (MB)':>12} | {'val acc':>7} | {'ms/clip':>7}")
+    print(f"{'original':<10} | {original_parameters:>11,} | {original_size_mb:>12.1f} | "
+          f"{original_accuracy:>7.4f} | {original_latency_ms:>7.1f}")
+    print(f"{'compressed':<10} | {compressed_parameters:>11,} | {compressed_size_mb:>12.1f} | "
+          f"{compressed_accuracy:>7.4f} | {compressed_latency_ms:>7.1f}")
+    print(f"Weights are {original_size_mb / compressed_size_mb:.1f}x smaller, "
+          f"inference is {original_latency_ms / compressed_latency_ms:.1f}x faster")
+
+"""# Incremental Fine-Tuning on Newly Ingested Matches"""
+
+import random
+import re
+from torch.utils.data import ConcatDataset, Dataset, Subset
+
+# Fine-tunes the last checkpoint on new feature bundles plus a replay sample of the old data
+run_incremental = False
+base_checkpoint_path = None  # None: the latest version of model_base_path on disk
+model_base_path = 'final_enhanced_gru_model.pth'
+new_feature_paths = []  # Feature bundles (.pt) or memmap directories of the new matches
+replay_paths = None  # None: everything the base checkpoint was trained on (its 'trained_on')
+replay_ratio = 1.0  # Old samples replayed per new sample
+incremental_epochs = 5
+incremental_learning_rate = learning_rate / 10
+
+class RelabeledDataset(Dataset):
+    """Maps a dataset's own label indices onto the merged label_to_index"""
+    def __init__(self, dataset, index_map):
+        self.dataset = dataset
+        self.index_map = index_map
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        features, label = self.dataset[idx]
+        return features, torch.tensor(self.index_map[int(label)])
+
+def load_feature_source(path):
+    """(dataset, label_to_index) for a feature bundle or a memmap directory, without reading the features into RAM"""
+    if os.path.isdir(path):
+        dataset = MemmapFeatureDataset(path)
+        return dataset, dataset.label_to_index
+    # mmap=True leaves the features on disk, only the sampled rows are paged in
+    try:
+        loaded = torch.load(path, mmap=True)
+    except (TypeError, RuntimeError):
+        loaded = torch.load(path)
+    return TensorDataset(loaded['features'], loaded['labels']), loaded['label_to_index']
+
+def checkpoint_versions(base_path):
+    """{version: path} of base_path (version 1) and its _v<N> fine-tuned versions on disk"""
+    base_name = re.sub(r'_v\d+$', '', os.path.splitext(base_path)[0])
+    versions = {1: f"{base_name}.pth"} if os.path.exists(f"{base_name}.pth") else {}
+    directory = os.path.dirname(base_name) or '.'
+    pattern = re.compile(re.escape(os.path.basename(base_name)) + r'_v(\d+)\.pth$')
+    for file_name in os.listdir(directory):
+        match = pattern.match(file_name)
+        if match:
+            versions[int(match.group(1))] = os.path.join(os.path.dirname(base_name), file_name)
+    return versions
+
+def merge_labels(label_to_index, source_label_to_index):
+    """Append unseen labels to label_to_index (existing indices never move); returns the source's index map"""
+    for label in source_label_to_index:
+        if label not in label_to_index:
+            label_to_index[label] = len(label_to_index)
+    return {index: label_to_index[label] for label, index in source_label_to_index.items()}
+
+if run_incremental:
+    if not new_feature_paths:
+        raise ValueError("new_feature_paths is empty: list the feature bundles or memmap directories of the new matches")
+    if base_checkpoint_path is None:
+        versions = checkpoint_versions(model_base_path)
+        base_checkpoint_path = versions[max(versions)] if versions else model_base_path
+    print(f"Fine-tuning {base_checkpoint_path}")
+    base_checkpoint = torch.load(base_checkpoint_path, map_location=device)
+    merged_label_to_index = dict(base_checkpoint['label_to_index'])
+    base_output_size = base_checkpoint['output_size']
+    # Earlier increments are replayed too, so fine-tuning v2 into v3 does not forget v2's matches
+    if replay_paths is None:
+        replay_paths = base_checkpoint.get('trained_on', [features_path])
+
+    # New matches, relabeled into the merged mapping
+    new_datasets = []
+    for path in new_feature_paths:
+        dataset, source_label_to_index = load_feature_source(path)
+        new_datasets.append(RelabeledDataset(dataset, merge_labels(merged_label_to_index, source_label_to_index)))
+    new_dataset = ConcatDataset(new_datasets)
+
+    # Replay sample of the old data, sized from the new data so an update costs O(new data)
+    replay_datasets = []
+    for path in replay_paths:
+        dataset, source_label_to_index = load_feature_source(path)
+        replay_datasets.append(RelabeledDataset(dataset, merge_labels(merged_label_to_index, source_label_to_index)))
+    replay_pool = ConcatDataset(replay_datasets)
+    replay_size = min(len(replay_pool), int(len(new_dataset) * replay_ratio))
+    replay_dataset = Subset(replay_pool, random.Random(0).sample(range(len(replay_pool)), replay_size))
+    print(f"Fine-tuning on {len(new_dataset)} new and {replay_size} replayed samples "
+          f"from {len(replay_paths)} earlier feature sources")
+
+    incremental_dataset = ConcatDataset([new_dataset, replay_dataset])
+    incremental_val_size = int(len(incremental_dataset) * validation_split)
+    incremental_train, incremental_val = random_split(
+        incremental_dataset, [len(incremental_dataset) - incremental_val_size, incremental_val_size],
+        generator=torch.Generator().manual_seed(42))
+    incremental_train_loader = DataLoader(incremental_train, batch_size=batch_size, shuffle=True, **loader_kwargs(device))
+    incremental_val_loader = DataLoader(incremental_val, batch_size=batch_size, **loader_kwargs(device))
+
+    incremental_model = EnhancedGRUModel(
+        base_checkpoint['input_size'],
+        base_checkpoint.get('hidden_size', 2048),
+        base_output_size,
+        num_layers=base_checkpoint.get('num_layers', 3),
+        downsample_factor=base_checkpoint.get('downsample_factor', 1),
+        downsample_mode=base_checkpoint.get('downsample_mode', 'pool')
+    ).to(device)
+    incremental_model.load_state_dict(base_checkpoint['model_state_dict'])
+
+    # New classes get fresh output rows; the rows of the existing classes are kept as trained
+    incremental_output_size = len(merged_label_to_index)
+    if incremental_output_size > base_output_size:
+        print(f"Adding {incremental_output_size - base_output_size} new classes")
+        old_fc3 = incremental_model.fc3
+        incremental_model.fc3 = nn.Linear(old_fc3.in_features, incremental_output_size).to(device)
+        with torch.no_grad():
+            incremental_model.fc3.weight[:base_output_size] = old_fc3.weight
+            incremental_model.fc3.bias[:base_output_size] = old_fc3.bias
+
+    incremental_optimizer = optim.Adam(incremental_model.parameters(), lr=incremental_learning_rate)
+    for epoch in range(incremental_epochs):
+        incremental_model.train()
+        total_train_loss = 0
+        for features_batch, labels_batch in incremental_train_loader:
+            features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+            incremental_optimizer.zero_grad()
+            loss = criterion(incremental_model(features_batch), labels_batch)
+            loss.backward()
+            incremental_optimizer.step()
+            total_train_loss += loss.item()
+
+        incremental_model.eval()
+        total_val_loss = 0
+        with torch.no_grad():
+            for features_batch, labels_batch in incremental_val_loader:
+                features_batch, labels_batch = features_batch.to(device), labels_batch.to(device)
+                total_val_loss += criterion(incremental_model(features_batch), labels_batch).item()
+        print(f'Epoch [{epoch + 1}/{incremental_epochs}], Train Loss: {total_train_loss / len(incremental_train_loader):.4f}, '
+              f'Validation Loss: {total_val_loss / max(1, len(incremental_val_loader)):.4f}')
+
+    # Next free version next to the base one; existing checkpoints are never overwritten
+    versions = checkpoint_versions(base_checkpoint_path)
+    version = max([base_checkpoint.get('version', 1), *versions]) + 1
+    base_name = re.sub(r'_v\d+$', '', os.path.splitext(base_checkpoint_path)[0])
+    versioned_path = f"{base_name}_v{version}.pth"
+    if os.path.exists(versioned_path):
+        raise FileExistsError(f"{versioned_path} already exists")
+    merged_unique_labels = sorted(merged_label_to_index, key=merged_label_to_index.get)
+    torch.save({
+        'model_state_dict': incremental_model.state_dict(),
+        'optimizer_state_dict': incremental_optimizer.state_dict(),
+        'loss': total_val_loss / max(1, len(incremental_val_loader)),
+        'label_to_index': merged_label_to_index,
+        'unique_labels': merged_unique_labels,
+        'input_size': base_checkpoint['input_size'],
+        'output_size': incremental_output_size,
+        'downsample_factor': base_checkpoint.get('downsample_factor', 1),
+        'downsample_mode': base_checkpoint.get('downsample_mode', 'pool'),
+        'hidden_size': base_checkpoint.get('hidden_size', 2048),
+        'num_layers': base_checkpoint.get('num_layers', 3),
+        'use_feature_reducer': False,
+        'version': version,
+        'parent': base_checkpoint_path,
+        'trained_on': base_checkpoint.get('trained_on', replay_paths) + new_feature_paths
+    }, versioned_path)
+    print(f"Incremental model saved to {versioned_path}")
 
-        # Confidence Score Output
-        confidence_score = self.fc_confidence(context_vector)
+"""# Predition on a Single Test video using the Saved Model"""
 
-        return {
-            'classification': classification_output,
-            'confidence': confidence_score,
-            'attention_weights': attention_weights
-        }
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import cv2
+import numpy as np
+import torchvision.models as models
+from temporal_models import AttentionEnhancedGRUModel, TemporalEncoderModel
 
 def extract_features(video_clip, device):
     # Load ResNet model for feature extraction
@@ -464,11 +961,25 @@ def predict_video(video_path, model_path):
     checkpoint = torch.load(model_path, map_location=device, weights_only=True)
 
     # Recreate the model with the same architecture
-    model = AttentionEnhancedGRUModel(
-        input_size=checkpoint['input_size'],
-        hidden_size=2048,
-        output_size=checkpoint['output_size']
-    ).to(device)
+    if checkpoint.get('temporal_head', 'gru') == 'gru':
+        model = AttentionEnhancedGRUModel(
+            input_size=checkpoint['input_size'],
+            hidden_size=checkpoint.get('hidden_size', 2048),
+            output_size=checkpoint['output_size'],
+            downsample_factor=checkpoint.get('downsample_factor', 1),
+            downsample_mode=checkpoint.get('downsample_mode', 'pool')
+        ).to(device)
+    else:
+        model = TemporalEncoderModel(
+            input_size=checkpoint['input_size'],
+            hidden_size=checkpoint['hidden_size'],
+            output_size=checkpoint['output_size'],
+            encoder=checkpoint['temporal_head'],
+            num_layers=checkpoint.get('encoder_layers', 4),
+            use_feature_reducer=checkpoint.get('use_feature_reducer', False),
+            downsample_factor=checkpoint.get('downsample_factor', 1),
+            downsample_mode=checkpoint.get('downsample_mode', 'pool')
+        ).to(device)
 
     # Load the model weights
     model.load_state_dict(checkpoint['model_state_dict'])
@@ -531,37 +1042,20 @@ from torchvision.models import resnet50
 import torch.nn.functional as F
 from collections import Counter
 import itertools
+from temporal_models import EnhancedGRUModel, compress_enhanced_gru
 
-class EnhancedGRUModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3):
-        super(EnhancedGRUModel, self).__init__()
-
-        self.feature_reducer = nn.Linear(input_size, 1000)  # Reduce features to 1000
-
-        self.gru = nn.GRU(1000, hidden_size, num_layers=num_layers, batch_first=True, dropout=dropout)
-
-        self.fc1 = nn.Linear(hidden_size, hidden_size * 2)
-        self.fc2 = nn.Linear(hidden_size * 2, hidden_size)
-        self.fc3 = nn.Linear(hidden_size, output_size)
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(dropout)
-
-    def forward(self, x):
-        # Reduce feature dimensions
-        x = self.feature_reducer(x)
+class HighlightGenerator:
+    # Checkpoints written by the training and distillation cells
+    model_paths = {
+        'teacher': 'final_enhanced_gru_model.pth',
+        'student': 'student_enhanced_gru_model.pth',
+        'compressed': 'compressed_enhanced_gru_model.pth'
+    }
 
-        out, _ = self.gru(x)
-        out = out[:, -1, :]
-        out = self.fc1(out)
-        out = self.relu(out)
-        out = self.dropout(out)
-        out = self.fc2(out)
-        out = self.relu(out)
-        out = self.dropout(out)
-        return self.fc3(out)
+    def __init__(self, model_path=None, variant='teacher'):
+        if model_path is None:
+            model_path = self.model_paths[variant]
 
-class HighlightGenerator:
-    def __init__(self, model_path='final_enhanced_gru_model.pth'):
         # Rankings dictionary
         self.rankings = {
            "Shots on target": 1, "Red card": 2,
@@ -575,16 +1069,29 @@ class HighlightGenerator:
         # Load the model with weights_only=True
         checkpoint = torch.load(model_path, map_location=self.device, weights_only=True)
 
-        # Model parameters
+        # Model parameters (a distilled student records its own, smaller, architecture)
         input_size = 2048  # ResNet feature size
-        hidden_size = 2048
+        hidden_size = checkpoint.get('hidden_size', 2048)
+        num_layers = checkpoint.get('num_layers', 3)
         output_size = checkpoint['output_size']
 
-        # Initialize model
-        self.model = EnhancedGRUModel(input_size, hidden_size, output_size).to(self.device)
+        # Initialize the model with the architecture recorded in the checkpoint; older
+        # checkpoints without 'use_feature_reducer' are told apart by their weights
+        use_feature_reducer = checkpoint.get('use_feature_reducer',
+                                             'feature_reducer.weight' in checkpoint['model_state_dict'])
+        self.model = EnhancedGRUModel(
+            input_size,
+            hidden_size,
+            output_size,
+            num_layers=num_layers,
+            use_feature_reducer=use_feature_reducer,
+            downsample_factor=checkpoint.get('downsample_factor', 1),
+            downsample_mode=checkpoint.get('downsample_mode', 'pool')
+        ).to(self.device)
+        if 'compression' in checkpoint:
+            compress_enhanced_gru(self.model, **checkpoint['compression'])
 
-        # Load state dict with strict=False to ignore missing keys
-        self.model.load_state_dict(checkpoint['model_state_dict'], strict=False)
+        self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model.eval()
 
         # Store label mapping
@@ -637,12 +1144,8 @@ class HighlightGenerator:
                 # Reset clip
                 current_clip = []
 
-        # Handle last incomplete clip if exists
+        # Handle last incomplete clip if exists (the GRU takes it at its true length)
         if current_clip:
-            # Pad the clip to match the expected length
-            while len(current_clip) < clip_frames:
-                current_clip.append(current_clip[-1])  # Repeat last frame
-
             clip_tensor = self.process_clip(current_clip)
             video_features.append(clip_tensor)
             video_clips.append(current_clip)
@@ -800,69 +1303,9 @@ from torchvision.models import resnet50
 import torch.nn.functional as F
 from collections import Counter
 import itertools
-
-class AttentionEnhancedGRUModel(nn.Module):
-    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3, use_feature_reducer=True):
-        super(AttentionEnhancedGRUModel, self).__init__()
-
-        # Optional feature reducer
-        self.use_feature_reducer = use_feature_reducer
-        if use_feature_reducer:
-            self.feature_reducer = nn.Linear(input_size, 1000)
-            gru_input_size = 1000
-        else:
-            gru_input_size = input_size
-
-        # GRU Layers with Attention Mechanism
-        self.gru = nn.GRU(gru_input_size, hidden_size, num_layers=num_layers,
-                          batch_first=True, dropout=dropout)
-
-        # Attention Mechanism
-        self.attention_layer = nn.Linear(hidden_size, 1)
-
-        # Fully Connected Layers for Classification
-        self.fc_classification = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size * 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size * 2, hidden_size),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size, output_size)
-        )
-
-        # Confidence Score Layer
-        self.fc_confidence = nn.Sequential(
-            nn.Linear(hidden_size, hidden_size // 2),
-            nn.ReLU(),
-            nn.Dropout(dropout),
-            nn.Linear(hidden_size // 2, 1),
-            nn.Sigmoid()  # Outputs a confidence score between 0 and 1
-        )
-
-    def forward(self, x):
-        # Optional feature reduction
-        if self.use_feature_reducer:
-            x = self.feature_reducer(x)
-
-        # GRU processing
-        gru_out, _ = self.gru(x)
-
-        # Attention Mechanism
-        attention_weights = F.softmax(self.attention_layer(gru_out), dim=1)
-        context_vector = torch.sum(gru_out * attention_weights, dim=1)
-
-        # Classification Output
-        classification_output = self.fc_classification(context_vector)
-
-        # Confidence Score Output
-        confidence_score = self.fc_confidence(context_vector)
-
-        return {
-            'classification': classification_output,
-            'confidence': confidence_score,
-            'attention_weights': attention_weights
-        }
+import json
+import time
+from temporal_models import AttentionEnhancedGRUModel, TemporalEncoderModel
 
 class HighlightGenerator:
     def __init__(self, model_path='final_attention_enhanced_gru_model.pth'):
@@ -881,27 +1324,35 @@ class HighlightGenerator:
 
         # Model parameters
         input_size = 2048  # ResNet feature size
-        hidden_size = 2048
+        hidden_size = checkpoint.get('hidden_size', 2048)
         output_size = checkpoint['output_size']
 
-        # Initialize model with flexible feature reducer
-        self.model = AttentionEnhancedGRUModel(
-            input_size,
-            hidden_size,
-            output_size,
-            use_feature_reducer=True
-        ).to(self.device)
-
-        # Load state dict with partial loading
-        model_dict = self.model.state_dict()
-        checkpoint_dict = checkpoint['model_state_dict']
-
-        # Only load matching keys
-        pretrained_dict = {k: v for k, v in checkpoint_dict.items() if k in model_dict}
-        model_dict.update(pretrained_dict)
-
-        # Load the updated state dictionary
-        self.model.load_state_dict(model_dict)
+        # Initialize the model with the architecture recorded in the checkpoint; older
+        # checkpoints without 'use_feature_reducer' are told apart by their weights
+        use_feature_reducer = checkpoint.get('use_feature_reducer',
+                                             'feature_reducer.weight' in checkpoint['model_state_dict'])
+        if checkpoint.get('temporal_head', 'gru') == 'gru':
+            self.model = AttentionEnhancedGRUModel(
+                input_size,
+                hidden_size,
+                output_size,
+                use_feature_reducer=use_feature_reducer,
+                downsample_factor=checkpoint.get('downsample_factor', 1),
+                downsample_mode=checkpoint.get('downsample_mode', 'pool')
+            ).to(self.device)
+        else:
+            self.model = TemporalEncoderModel(
+                input_size,
+                checkpoint['hidden_size'],
+                output_size,
+                encoder=checkpoint['temporal_head'],
+                num_layers=checkpoint.get('encoder_layers', 4),
+                use_feature_reducer=use_feature_reducer,
+                downsample_factor=checkpoint.get('downsample_factor', 1),
+                downsample_mode=checkpoint.get('downsample_mode', 'pool')
+            ).to(self.device)
+
+        self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model.eval()
 
         # Store label mapping
@@ -922,8 +1373,13 @@ class HighlightGenerator:
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ])
 
-    def extract_features(self, video_path):
-        """Extract features from video clips"""
+    def extract_features(self, video_path, keep_frames=True):
+        """
+        Extract features from video clips
+
+        With keep_frames=False the frames are dropped once featurised and each
+        clip is returned as its range of frame indices; read_clips decodes them again.
+        """
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         clip_duration = 20  # seconds
@@ -948,20 +1404,16 @@ class HighlightGenerator:
                 # Convert clip to features
                 clip_tensor = self.process_clip(current_clip)
                 video_features.append(clip_tensor)
-                video_clips.append(current_clip)
+                video_clips.append(current_clip if keep_frames else range(frame_count - len(current_clip), frame_count))
 
                 # Reset clip
                 current_clip = []
 
-        # Handle last incomplete clip if exists
+        # Handle last incomplete clip if exists (the GRU takes it at its true length)
         if current_clip:
-            # Pad the clip to match the expected length
-            while len(current_clip) < clip_frames:
-                current_clip.append(current_clip[-1])  # Repeat last frame
-
             clip_tensor = self.process_clip(current_clip)
             video_features.append(clip_tensor)
-            video_clips.append(current_clip)
+            video_clips.append(current_clip if keep_frames else range(frame_count - len(current_clip), frame_count))
 
         cap.release()
 
@@ -979,10 +1431,11 @@ class HighlightGenerator:
 
         return torch.tensor(clip_features).float().unsqueeze(0)
 
-    def predict_highlights(self, video_features):
+    def predict_highlights(self, video_features, return_attention=False):
         """Predict highlights for each clip with confidence"""
         predictions = []
         confidences = []
+        attention = []
 
         with torch.no_grad():
             for features in video_features:
@@ -998,19 +1451,329 @@ class HighlightGenerator:
 
                 predictions.append(predicted_label)
                 confidences.append(confidence_score)
+                if return_attention:
+                    # (1, seq_len, 1) -> (seq_len,)
+                    attention.append(output['attention_weights'].view(-1).cpu().numpy())
 
                 print(f"Predicted label: {predicted_label}, Confidence: {confidence_score:.2f}")
 
+        if return_attention:
+            return predictions, confidences, attention
         return predictions, confidences
 
-    def create_highlights(self, video_path, highlight_duration_minutes):
+    def coarse_scan(self, video_path, coarse_fps=1.0, candidate_threshold=0.5, neighbor_clips=1):
         """
-        Generate highlights with confidence-based selection
+        Cheap first pass over a full match.
+
+        Only `coarse_fps` frames per second are run through ResNet. The rest are
+        grabbed without being converted or featurised, but grab() still decodes
+        them, so the saving is in ResNet and not in decoding. The GRU scores each
+        20 second clip from that sparse sequence although it was trained on dense
+        clips; check the recall with estimate_coarse_recall before relying on it. A clip is a candidate when the
+        probability mass on ranked labels reaches `candidate_threshold`; its
+        `neighbor_clips` on either side are kept as context.
+        Returns (sorted candidate clip indices, total number of clips).
         """
-        # Extract features and predict labels with confidence
-        video_features, video_clips = self.extract_features(video_path)
-        predictions, confidences = self.predict_highlights(video_features)
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        clip_duration = 20  # seconds, same as extract_features
+        clip_frames = int(fps * clip_duration)
+        step = max(1, int(round(fps / coarse_fps)))
+
+        highlight_labels = list(self.rankings.keys()) + ["Goal"]
+        highlight_indices = [self.label_to_index[label] for label in highlight_labels if label in self.label_to_index]
+
+        clip_scores = []
+        sampled = []
+        frame_index = 0
 
+        while True:
+            if frame_index % step == 0:
+                ret, frame = cap.read()
+                if ret:
+                    sampled.append(frame)
+            else:
+                ret = cap.grab()
+            if not ret:
+                break
+
+            frame_index += 1
+            if frame_index % clip_frames == 0:
+                clip_scores.append(self._coarse_clip_score(sampled, highlight_indices))
+                sampled = []
+
+        if sampled:
+            clip_scores.append(self._coarse_clip_score(sampled, highlight_indices))
+
+        cap.release()
+
+        num_clips = len(clip_scores)
+        candidates = set()
+        for i, score in enumerate(clip_scores):
+            if score >= candidate_threshold:
+                candidates.update(range(max(0, i - neighbor_clips), min(num_clips, i + neighbor_clips + 1)))
+
+        return sorted(candidates), num_clips
+
+    def _coarse_clip_score(self, sampled_frames, highlight_indices):
+        """Probability that a sparsely sampled clip contains a ranked event"""
+        features = self.process_clip(sampled_frames).to(self.device)
+        with torch.no_grad():
+            output = self.model(features)
+            prob = F.softmax(output['classification'], dim=1)
+        return prob[0, highlight_indices].sum().item()
+
+    def extract_clip_features(self, video_path, clip_indices):
+        """
+        Full-rate feature extraction for selected clips only.
+
+        The gaps between candidate windows are skipped with grab(), which still
+        decodes but does not convert or featurise them. Seeking is not
+        frame-accurate, and a few frames off would shift the clips against the
+        coarse clip indices. Returns the features and frames of every clip that
+        could be read, and the match clip index of each.
+        """
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        clip_duration = 20  # seconds
+        clip_frames = int(fps * clip_duration)
+
+        video_features = []
+        video_clips = []
+        kept_indices = []
+        next_frame = 0
+
+        for clip_index in sorted(clip_indices):
+            start_frame = clip_index * clip_frames
+            while next_frame < start_frame and cap.grab():
+                next_frame += 1
+            if next_frame < start_frame:
+                break  # The video ended before this clip
+
+            current_clip = []
+            while len(current_clip) < clip_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                current_clip.append(frame)
+            next_frame = start_frame + len(current_clip)
+
+            if not current_clip:
+                continue
+
+            video_features.append(self.process_clip(current_clip))
+            video_clips.append(current_clip)
+            kept_indices.append(clip_index)
+
+        cap.release()
+
+        return video_features, video_clips, kept_indices
+
+    def estimate_coarse_recall(self, labelled_matches, coarse_fps=1.0, candidate_threshold=0.5,
+                               neighbor_clips=1, compare_full_pass=False):
+        """
+        Measure how much the coarse pass misses on labelled matches.
+
+        `labelled_matches` is a list of (video_path, labels_json_path, half) using
+        SoccerNet Labels-v2.json annotations. Recall is the share of ranked events
+        whose clip is a coarse candidate. With compare_full_pass, the full-rate
+        pipeline is also run to report recall against its highlight clips and the
+        measured speedup.
+        """
+        highlight_labels = set(self.rankings.keys()) | {"Goal"}
+        clip_duration = 20  # seconds
+
+        total_events = 0
+        hit_events = 0
+        total_clips = 0
+        candidate_clips = 0
+        full_hits = 0
+        full_total = 0
+        two_stage_time = 0.0
+        full_time = 0.0
+
+        for video_path, labels_path, half in labelled_matches:
+            start = time.time()
+            candidates, num_clips = self.coarse_scan(video_path, coarse_fps, candidate_threshold, neighbor_clips)
+            self.extract_clip_features(video_path, candidates)
+            two_stage_time += time.time() - start
+
+            candidate_set = set(candidates)
+            total_clips += num_clips
+            candidate_clips += len(candidates)
+
+            with open(labels_path) as f:
+                annotations = json.load(f)["annotations"]
+            for annotation in annotations:
+                if annotation["label"] not in highlight_labels:
+                    continue
+                if annotation["gameTime"].split(" - ")[0] != str(half):
+                    continue
+                total_events += 1
+                if int(annotation["position"]) // 1000 // clip_duration in candidate_set:
+                    hit_events += 1
+
+            if compare_full_pass:
+                start = time.time()
+                video_features, _ = self.extract_features(video_path)
+                predictions, _ = self.predict_highlights(video_features)
+                full_time += time.time() - start
+
+                full_highlights = [i for i, label in enumerate(predictions) if label in highlight_labels]
+                full_total += len(full_highlights)
+                full_hits += sum(1 for i in full_highlights if i in candidate_set)
+
+        report = {
+            'event_recall': hit_events / total_events if total_events else None,
+            'candidate_fraction': candidate_clips / total_clips if total_clips else None,
+            'two_stage_seconds': two_stage_time
+        }
+        if compare_full_pass:
+            report['full_pass_recall'] = full_hits / full_total if full_total else None
+            report['full_pass_seconds'] = full_time
+            report['speedup'] = full_time / two_stage_time if two_stage_time else None
+
+        print("Coarse-to-fine recall report:")
+        for key, value in report.items():
+            print(f"  {key}: {value}")
+
+        return report
+
+    def find_duplicate_clips(self, video_features, clip_seconds, similarity_threshold=0.9, horizon_seconds=180,
+                             clip_indices=None, min_gap_clips=2, cut_similarity=0.8):
+        """
+        Find clips that repeat an earlier clip, such as broadcast replays.
+
+        Each clip is summarised by its mean ResNet feature vector, centred on the
+        match-wide mean so the shared pitch/broadcast look does not dominate the
+        cosine similarity. A clip only counts as a replay of an earlier one that
+        is at least `min_gap_clips` clips and at most `horizon_seconds` before it,
+        and only when there is a shot cut (consecutive frames with cosine
+        similarity below `cut_similarity`) after the original, so one continuous
+        camera shot spanning neighbouring clips is never collapsed.
+        Returns {duplicate_index: original_index}, where the original is the
+        earliest non-duplicate match. `clip_indices` gives each clip's position in
+        the match when only some clips were extracted.
+        """
+        if len(video_features) < 2:
+            return {}
+        if clip_indices is None:
+            clip_indices = list(range(len(video_features)))
+
+        embeddings = torch.stack([features.mean(dim=1).squeeze(0) for features in video_features])
+        embeddings = F.normalize(embeddings - embeddings.mean(dim=0, keepdim=True), dim=1)
+        similarity = embeddings @ embeddings.T
+
+        # Shot cuts inside each clip, and at its start when it directly follows the previous clip
+        has_cut = []
+        for k, features in enumerate(video_features):
+            frames = F.normalize(features.squeeze(0), dim=1)
+            if k > 0 and clip_indices[k] - clip_indices[k - 1] == 1:
+                previous = F.normalize(video_features[k - 1].squeeze(0)[-1:], dim=1)
+                frames = torch.cat([previous, frames])
+            steps = (frames[1:] * frames[:-1]).sum(dim=1)
+            has_cut.append(bool(len(steps)) and steps.min().item() < cut_similarity)
+
+        horizon = max(1, int(horizon_seconds // clip_seconds))
+        duplicates = {}
+        for i in range(1, len(video_features)):
+            for j in range(i):
+                gap = clip_indices[i] - clip_indices[j]
+                if gap > horizon or gap < min_gap_clips:
+                    continue
+                if j in duplicates or similarity[i, j].item() < similarity_threshold:
+                    continue
+                # A replay is cut to, so the broadcast must have changed shot since the original
+                if any(has_cut[j + 1:i + 1]):
+                    duplicates[i] = j
+                    break
+
+        return duplicates
+
+    def trim_clip_with_attention(self, clip, attention_weights, fps, min_seconds=4, max_seconds=20,
+                                 padding_seconds=1.0, attention_mass=0.8):
+        """
+        Cut a clip down to the shortest span of frames that holds `attention_mass`
+        of the GRU attention, plus padding on both sides, kept within min/max length.
+        """
+        num_frames = len(clip)
+
+        # Spread the per-timestep weights over frames (timesteps may be fewer than frames)
+        step_index = np.minimum(np.arange(num_frames) * len(attention_weights) // num_frames,
+                                len(attention_weights) - 1)
+        frame_weights = np.asarray(attention_weights, dtype=np.float64)[step_index]
+        frame_weights = frame_weights / frame_weights.sum()
+
+        # Shortest window covering the requested attention mass (two pointers)
+        cumulative = np.concatenate([[0.0], np.cumsum(frame_weights)])
+        best_start, best_end = 0, num_frames
+        end = 0
+        for start in range(num_frames):
+            while end < num_frames and cumulative[end] - cumulative[start] < attention_mass:
+                end += 1
+            if cumulative[end] - cumulative[start] < attention_mass:
+                break
+            if end - start < best_end - best_start:
+                best_start, best_end = start, end
+
+        # Pad, then clamp the length to [min_seconds, max_seconds] around the core's centre
+        padding = int(round(padding_seconds * fps))
+        start = max(0, best_start - padding)
+        end = min(num_frames, best_end + padding)
+
+        min_frames = min(num_frames, int(round(min_seconds * fps)))
+        max_frames = min(num_frames, int(round(max_seconds * fps)))
+        length = min(max(end - start, min_frames), max_frames)
+
+        centre = (best_start + best_end) // 2
+        start = min(max(0, centre - length // 2), num_frames - length)
+
+        return clip[start:start + length]
+
+    def probe_video(self, video_path):
+        """Read the stream properties of a video without decoding any frames"""
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            cap.release()
+            return None
+
+        info = {
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        }
+        cap.release()
+
+        return info
+
+    def read_clips(self, video_path, frame_ranges):
+        """Decode the frames of each frame range in one sequential pass; clips come back in the order given"""
+        wanted = {}
+        for clip_number, frame_range in enumerate(frame_ranges):
+            for frame_index in frame_range:
+                wanted[frame_index] = clip_number
+        clips = [[] for _ in frame_ranges]
+        last_frame = max((frame_range.stop for frame_range in frame_ranges), default=0)
+
+        cap = cv2.VideoCapture(video_path)
+        frame_index = 0
+        while frame_index < last_frame:
+            if frame_index in wanted:
+                ret, frame = cap.read()
+                if ret:
+                    clips[wanted[frame_index]].append(frame)
+            else:
+                ret = cap.grab()
+            if not ret:
+                break
+            frame_index += 1
+        cap.release()
+
+        return clips
+
+    def select_clips(self, predictions, confidences, video_clips, fps, highlight_duration_minutes):
+        """Pick clips for the reel by label ranking and confidence"""
         # Group clips by label with confidence tracking
         labeled_clips = {}
         for label, clip, conf in zip(predictions, video_clips, confidences):
@@ -1026,21 +1789,16 @@ class HighlightGenerator:
         total_duration = 0
         max_duration = highlight_duration_minutes * 60
 
-        # Get video capture details
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        clip_duration = len(video_clips[0]) / fps
-        cap.release()
-
         # Strategy for clip selection with confidence
         # 1. Start with highest-confidence Goal clip if available
         goal_clips = sorted(labeled_clips.get("Goal", []), key=lambda x: x[1], reverse=True)
         if goal_clips:
             highlight_clips.append(goal_clips[0][0])
-            total_duration += clip_duration
+            total_duration += len(goal_clips[0][0]) / fps
 
         # Add clips to fill the highlight duration
         while total_duration < max_duration:
+            added = False
             for label in sorted_labels:
                 # Skip if we've reached max duration
                 if total_duration >= max_duration:
@@ -1052,10 +1810,19 @@ class HighlightGenerator:
                     sorted_clips = sorted(labeled_clips[label], key=lambda x: x[1], reverse=True)
                     highlight_clips.append(sorted_clips[0][0])
                     labeled_clips[label].remove(sorted_clips[0])
-                    total_duration += clip_duration
+                    total_duration += len(sorted_clips[0][0]) / fps
+                    added = True
 
-        # Video writing process
-        output_path = f'highlights_{highlight_duration_minutes}min.mp4'
+            # Stop once every ranked label has run out of clips
+            if not added:
+                break
+
+        return highlight_clips
+
+    def render_highlights(self, highlight_clips, fps, output_path):
+        """Stitch the selected clips into the output video"""
+        if not highlight_clips:
+            raise ValueError(f"No highlight clips to render into {output_path}")
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
 
         # Create video writer
@@ -1071,6 +1838,578 @@ class HighlightGenerator:
 
         return output_path
 
+    def create_highlights(self, video_path, highlight_duration_minutes, trim_with_attention=False,
+                          min_clip_seconds=4, max_clip_seconds=20, trim_padding_seconds=1.0,
+                          drop_replays=False, replay_similarity=0.9, replay_horizon_seconds=180,
+                          two_stage=False, coarse_fps=1.0, candidate_threshold=0.5):
+        """
+        Generate highlights with confidence-based selection
+
+        With trim_with_attention, every clip is cut down to the part the GRU
+        attended to, so more events fit into the same highlight duration.
+        With drop_replays, clips that repeat an earlier clip are collapsed into
+        it and never reach the GRU or the reel.
+        With two_stage, a low frame rate coarse_scan picks candidate windows and
+        only those are featurised and scored at full rate.
+        """
+        # Extract features and predict labels with confidence
+        candidates = None
+        if two_stage:
+            candidates, num_clips = self.coarse_scan(video_path, coarse_fps, candidate_threshold)
+            print(f"Coarse pass kept {len(candidates)} of {num_clips} clips")
+            if not candidates:
+                print("Coarse pass found no candidates, falling back to the full-rate pass")
+        if candidates:
+            video_features, video_clips, clip_indices = self.extract_clip_features(video_path, candidates)
+        else:
+            video_features, video_clips = self.extract_features(video_path)
+            clip_indices = None
+        if not video_clips:
+            print(f"No frames could be read from {video_path}")
+            return None
+        fps = self.probe_video(video_path)['fps']
+
+        if drop_replays:
+            duplicates = self.find_duplicate_clips(video_features, len(video_clips[0]) / fps,
+                                                   replay_similarity, replay_horizon_seconds, clip_indices)
+            print(f"Collapsed {len(duplicates)} replayed clips into their original events")
+            video_features = [f for i, f in enumerate(video_features) if i not in duplicates]
+            video_clips = [c for i, c in enumerate(video_clips) if i not in duplicates]
+
+        if trim_with_attention:
+            predictions, confidences, attention = self.predict_highlights(video_features, return_attention=True)
+            video_clips = [
+                self.trim_clip_with_attention(clip, weights, fps, min_clip_seconds,
+                                              max_clip_seconds, trim_padding_seconds)
+                for clip, weights in zip(video_clips, attention)
+            ]
+        else:
+            predictions, confidences = self.predict_highlights(video_features)
+
+        # Select clips and write the reel
+        highlight_clips = self.select_clips(predictions, confidences, video_clips, fps, highlight_duration_minutes)
+        if not highlight_clips:
+            print("No clips were predicted as highlights, no reel written")
+            return None
+
+        output_path = f'highlights_{highlight_duration_minutes}min.mp4'
+        return self.render_highlights(highlight_clips, fps, output_path)
+
+    def tail_highlights(self, source, highlight_duration_minutes, output_path='highlights_live.mp4',
+                        update_interval=60, render_interval=300, poll_interval=2.0, idle_timeout=30.0,
+                        on_update=None):
+        """
+        Follow a recording that is still being written and keep the reel up to date.
+
+        `source` is either a directory of segment files picked up in name order, or
+        a single growing file in a container that is readable before it is closed
+        (e.g. MJPG .avi/.mkv or MPEG-TS; an .mp4 has no index until it is finished).
+        The newest segment may still be being written, so it is only read once a
+        newer one appears or the recording has been idle for idle_timeout. Each
+        clip is featurised and scored once as soon as it is full, and every update
+        reuses the stored predictions of earlier clips. Only the frame range of each
+        clip is kept; the selected clips are decoded again when the reel is rendered.
+
+        The timeline is written every update_interval seconds; the reel is only
+        re-rendered when its selection changed, at most every render_interval
+        seconds, and once more at the end.
+        """
+        state = {
+            'fps': None,
+            'frames_read': 0,  # Frames consumed so far, across all segments
+            'size_read': None,  # Size of the growing file at its last read
+            'segments': [],  # (segment path, first frame, frame count) of the finished segments
+            'segments_read': set(),  # Finished segment files
+            'rendered_selection': None,
+            'last_render': 0.0
+        }
+        clip_duration = 20  # seconds, same as extract_features
+        clip_frames = None
+
+        video_clips = []  # Frame range of every scored clip
+        predictions = []
+        confidences = []
+        current_clip = []
+        frame_count = 0
+
+        last_update = time.time()
+        last_arrival = time.time()
+        last_source_size = None
+        clips_at_last_update = 0
+
+        while True:
+            new_frames = self._read_new_frames(source, state)
+
+            # A source that is still growing counts as activity even before its frames can be read
+            source_size = self._source_size(source)
+            if new_frames or source_size != last_source_size:
+                last_arrival = time.time()
+                last_source_size = source_size
+
+            finished = time.time() - last_arrival >= idle_timeout
+            if finished:
+                # Nothing changed for idle_timeout, so the newest segment / end of the file is complete
+                new_frames += self._read_new_frames(source, state, final=True)
+
+            if new_frames and clip_frames is None:
+                clip_frames = int(state['fps'] * clip_duration)
+
+            for frame in new_frames:
+                current_clip.append(frame)
+                frame_count += 1
+                if len(current_clip) == clip_frames:
+                    # Featurise and score the finished clip exactly once
+                    clip_tensor = self.process_clip(current_clip)
+                    clip_predictions, clip_confidences = self.predict_highlights([clip_tensor])
+                    video_clips.append(range(frame_count - len(current_clip), frame_count))
+                    predictions.extend(clip_predictions)
+                    confidences.extend(clip_confidences)
+                    current_clip = []
+
+            if finished and current_clip:
+                # Score the trailing partial clip once the recording has stopped growing
+                clip_tensor = self.process_clip(current_clip)
+                clip_predictions, clip_confidences = self.predict_highlights([clip_tensor])
+                video_clips.append(range(frame_count - len(current_clip), frame_count))
+                predictions.extend(clip_predictions)
+                confidences.extend(clip_confidences)
+                current_clip = []
+
+            due = finished or time.time() - last_update >= update_interval
+            if due and len(video_clips) > clips_at_last_update:
+                render_due = finished or time.time() - state['last_render'] >= render_interval
+                timeline = self._emit_live_update(source, video_clips, predictions, confidences,
+                                                  highlight_duration_minutes, output_path, state, render_due)
+                clips_at_last_update = len(video_clips)
+                last_update = time.time()
+                if on_update is not None:
+                    on_update(timeline, output_path)
+
+            if finished:
+                break
+
+            if not new_frames:
+                time.sleep(poll_interval)
+
+        return output_path
+
+    def _source_size(self, source):
+        """Bytes in the growing file or segment directory (hidden partial segments included)"""
+        if os.path.isdir(source):
+            total = 0
+            for f in os.listdir(source):
+                try:
+                    total += os.path.getsize(os.path.join(source, f))
+                except OSError:
+                    pass  # Renamed or removed between listdir and stat
+            return total
+        return os.path.getsize(source) if os.path.exists(source) else 0
+
+    def _read_new_frames(self, source, state, final=False):
+        """
+        Decode only the frames that were not read on a previous poll.
+        With final=True the source has stopped growing, so the newest segment and the
+        last frame of a growing file are read as well.
+        """
+        frames = []
+
+        if os.path.isdir(source):
+            segment_files = sorted(
+                f for f in os.listdir(source)
+                if f.endswith(('.mp4', '.avi', '.mkv', '.ts')) and not f.startswith('.')
+                and f not in state['segments_read']
+            )
+            if not final:
+                # The newest segment may still be being written
+                segment_files = segment_files[:-1]
+            for segment_file in segment_files:
+                cap = cv2.VideoCapture(os.path.join(source, segment_file))
+                if not cap.isOpened():
+                    cap.release()
+                    if final:
+                        print(f"Error: Could not open segment {segment_file}, skipping it")
+                        state['segments_read'].add(segment_file)
+                        continue
+                    break  # Segment not readable yet, try again on the next poll
+                if state['fps'] is None:
+                    state['fps'] = cap.get(cv2.CAP_PROP_FPS)
+                num_frames = 0
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    frames.append(frame)
+                    num_frames += 1
+                cap.release()
+                state['segments'].append((os.path.join(source, segment_file), state['frames_read'], num_frames))
+                state['segments_read'].add(segment_file)
+                state['frames_read'] += num_frames
+            return frames
+
+        # A capture that reached the end of the file stays at EOF even after more data is appended,
+        # so the file is reopened whenever it grew and the frames consumed so far are skipped with
+        # grab(), which is frame-accurate where seeking is not
+        source_size = self._source_size(source)
+        if not final and source_size == state['size_read']:
+            return frames
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            cap.release()
+            return frames  # Not readable yet, e.g. no header written so far
+        if state['fps'] is None:
+            state['fps'] = cap.get(cv2.CAP_PROP_FPS)
+
+        skipped = 0
+        while skipped < state['frames_read'] and cap.grab():
+            skipped += 1
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+
+        if not final and frames:
+            frames.pop()  # The last frame may still be being written, read it on the next poll
+        state['size_read'] = source_size
+        state['frames_read'] += len(frames)
+        return frames
+
+    def _read_live_clips(self, source, state, frame_ranges):
+        """Decode clips given as frame ranges of the live recording, from the file or across its segments"""
+        if not os.path.isdir(source):
+            return self.read_clips(source, frame_ranges)
+
+        clips = [[] for _ in frame_ranges]
+        for segment_path, first_frame, num_frames in state['segments']:
+            local_ranges = []
+            clip_numbers = []
+            for clip_number, frame_range in enumerate(frame_ranges):
+                start = max(frame_range.start, first_frame)
+                stop = min(frame_range.stop, first_frame + num_frames)
+                if start < stop:
+                    local_ranges.append(range(start - first_frame, stop - first_frame))
+                    clip_numbers.append(clip_number)
+            if local_ranges:
+                # Segments are visited in order, so each clip's frames are appended in order
+                for clip_number, frames in zip(clip_numbers, self.read_clips(segment_path, local_ranges)):
+                    clips[clip_number].extend(frames)
+        return clips
+
+    def _emit_live_update(self, source, video_clips, predictions, confidences, highlight_duration_minutes,
+                          output_path, state, render_due=True):
+        """Write the candidate timeline and, when due and the selection changed, re-render the reel"""
+        fps = state['fps']
+        clip_seconds = len(video_clips[0]) / fps
+        timeline = [
+            {
+                'clip_index': i,
+                'start_seconds': i * clip_seconds,
+                'end_seconds': (i + 1) * clip_seconds,
+                'label': label,
+                'confidence': conf
+            }
+            for i, (label, conf) in enumerate(zip(predictions, confidences))
+            if label in self.rankings or label == "Goal"
+        ]
+
+        timeline_path = os.path.splitext(output_path)[0] + '_timeline.json'
+        with open(timeline_path + '.tmp', 'w') as f:
+            json.dump(timeline, f, indent=4)
+        os.replace(timeline_path + '.tmp', timeline_path)
+
+        highlight_clips = self.select_clips(predictions, confidences, video_clips, fps, highlight_duration_minutes)
+        clip_numbers = {id(clip): i for i, clip in enumerate(video_clips)}
+        selection = [clip_numbers[id(clip)] for clip in highlight_clips]
+        if highlight_clips and render_due and selection != state['rendered_selection']:
+            # Render next to the reel and swap it in so viewers never see a partial file
+            root, ext = os.path.splitext(output_path)
+            partial_path = f'{root}.partial{ext}'
+            self.render_highlights(self._read_live_clips(source, state, highlight_clips), fps, partial_path)
+            os.replace(partial_path, output_path)
+            state['rendered_selection'] = selection
+            state['last_render'] = time.time()
+            print(f"Live update: {len(video_clips)} clips scored, {len(timeline)} candidates, reel re-rendered at {output_path}")
+        else:
+            print(f"Live update: {len(video_clips)} clips scored, {len(timeline)} candidates")
+
+        return timeline
+
+def replay_recording(video_path, output_dir, segment_seconds=10, speed=1.0, single_file=False):
+    """
+    Replay a finished match into `output_dir` as a sequence of segment files,
+    paced at `speed` times real time. Used to exercise tail_highlights locally.
+
+    With single_file, the match is instead appended to one growing
+    `output_dir/recording.avi` (MJPG, which stays readable while it is written;
+    OpenCV's .mp4 writer only produces a readable file once it is closed).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Unable to open video file {video_path}")
+        return
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    segment_frames = int(fps * segment_seconds)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    segment_number = 0
+    start = time.time()
+    frames_written = 0
+    out = None
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        if single_file:
+            if out is None:
+                out = cv2.VideoWriter(os.path.join(output_dir, "recording.avi"), cv2.VideoWriter_fourcc(*'MJPG'),
+                                      fps, (frame.shape[1], frame.shape[0]))
+            out.write(frame)
+            frames_written += 1
+            delay = frames_written / (fps * speed) - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+            continue
+
+        if out is None:
+            segment_number += 1
+            # Write under a hidden name so the tailer never opens a half-written segment
+            partial_path = os.path.join(output_dir, f".segment_{segment_number:05d}.mp4")
+            out = cv2.VideoWriter(partial_path, fourcc, fps, (frame.shape[1], frame.shape[0]))
+            segment_written = 0
+
+        out.write(frame)
+        segment_written += 1
+        frames_written += 1
+
+        if segment_written == segment_frames:
+            out.release()
+            os.replace(partial_path, os.path.join(output_dir, f"segment_{segment_number:05d}.mp4"))
+            out = None
+
+        # Hold back until the wall clock catches up with the stream
+        delay = frames_written / (fps * speed) - (time.time() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+    cap.release()
+    if single_file:
+        if out is not None:
+            out.release()
+        print(f"Replay finished: {frames_written} frames written to {os.path.join(output_dir, 'recording.avi')}")
+        return
+
+    if out is not None:
+        out.release()
+        os.replace(partial_path, os.path.join(output_dir, f"segment_{segment_number:05d}.mp4"))
+
+    print(f"Replay finished: {segment_number} segments written to {output_dir}")
+
+"""# Priority Job Scheduler (Per-Stage Worker Pools with Backpressure)"""
+
+import itertools
+import queue
+import threading
+import time
+
+# Priority classes (lower value is served first)
+URGENT = 0
+BULK = 1
+
+# Run the scheduler example instead of the interactive main() when the script is executed
+use_scheduler = False
+
+class HighlightJob:
+    def __init__(self, video_path, highlight_duration_minutes, priority=BULK, output_path=None):
+        self.video_path = video_path
+        self.highlight_duration_minutes = highlight_duration_minutes
+        self.priority = priority
+
+        # Give every job its own output file so concurrent jobs do not overwrite each other
+        if output_path is None:
+            video_name = os.path.splitext(os.path.basename(video_path))[0]
+            output_path = f'highlights_{video_name}_{highlight_duration_minutes}min.mp4'
+        self.output_path = output_path
+
+        self.result = None
+        self.error = None
+        self.stage_times = {}
+        self.submitted_at = time.time()
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes and return the reel path"""
+        self.done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class StagePool:
+    """
+    Worker pool for a single pipeline stage.
+
+    Jobs wait in a priority queue bounded to `capacity` entries. Bulk jobs may
+    only fill `capacity - urgent_reserve` of them, so a backlog of bulk work
+    can never block an urgent job from entering the stage.
+    """
+    def __init__(self, name, handler, num_workers, capacity, urgent_reserve=1):
+        if capacity <= urgent_reserve:
+            raise ValueError(f"Stage '{name}' needs capacity greater than urgent_reserve")
+
+        self.name = name
+        self.handler = handler
+        self.capacity = capacity
+        self.urgent_reserve = urgent_reserve
+        self.next_stage = None
+
+        self.queue = queue.PriorityQueue()
+        self.pending = 0
+        self.not_full = threading.Condition()
+        self.counter = itertools.count()
+
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, job, payload):
+        """Enqueue a job, blocking while this priority class has no free slot"""
+        limit = self.capacity if job.priority == URGENT else self.capacity - self.urgent_reserve
+        with self.not_full:
+            while self.pending >= limit:
+                self.not_full.wait()
+            self.pending += 1
+        # The counter keeps FIFO order within a priority class
+        self.queue.put((job.priority, next(self.counter), job, payload))
+
+    def close(self):
+        """Let the workers drain the queue and exit"""
+        for _ in self.workers:
+            self.queue.put((float('inf'), next(self.counter), None, None))
+        for worker in self.workers:
+            worker.join()
+
+    def _worker(self):
+        while True:
+            _, _, job, payload = self.queue.get()
+            if job is None:
+                break
+
+            with self.not_full:
+                self.pending -= 1
+                self.not_full.notify_all()
+
+            start = time.time()
+            try:
+                payload = self.handler(job, payload)
+            except Exception as e:
+                job.error = e
+                job.done.set()
+                print(f"[{self.name}] Job failed for {job.video_path}: {e}")
+                continue
+            job.stage_times[self.name] = time.time() - start
+
+            # Blocks while the next stage is full, which pushes back on this one
+            if self.next_stage is not None:
+                self.next_stage.put(job, payload)
+            else:
+                job.result = payload
+                job.done.set()
+
+class HighlightScheduler:
+    """
+    Runs HighlightGenerator jobs as a pipeline of stages:
+    probe -> features (decode + ResNet) -> scoring (GRU) -> selection -> render.
+
+    Each stage has its own worker pool sized to the resource it uses, so that
+    decoding, model inference and disk writes overlap across jobs.
+    """
+    def __init__(self, generator, probe_workers=2, feature_workers=2, scoring_workers=1,
+                 selection_workers=1, render_workers=2, queue_capacity=4, urgent_reserve=1):
+        self.generator = generator
+
+        stage_specs = [
+            ('probe', self._probe, probe_workers),
+            ('features', self._features, feature_workers),
+            ('scoring', self._scoring, scoring_workers),
+            ('selection', self._selection, selection_workers),
+            ('render', self._render, render_workers)
+        ]
+        self.stages = [
+            StagePool(name, handler, num_workers, queue_capacity, urgent_reserve)
+            for name, handler, num_workers in stage_specs
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+
+    def submit(self, video_path, highlight_duration_minutes, priority=BULK, output_path=None):
+        """Queue a highlight job; blocks while the probe stage is full for this priority"""
+        job = HighlightJob(video_path, highlight_duration_minutes, priority, output_path)
+        self.stages[0].put(job, {})
+        return job
+
+    def shutdown(self):
+        """Finish all queued jobs and stop the workers, one stage at a time"""
+        for stage in self.stages:
+            stage.close()
+
+    # Stage handlers
+    def _probe(self, job, payload):
+        info = self.generator.probe_video(job.video_path)
+        if info is None:
+            raise IOError(f"Unable to open video {job.video_path}")
+        payload['fps'] = info['fps']
+        return payload
+
+    def _features(self, job, payload):
+        # Clips travel between stages as frame ranges; only the render stage decodes frames again
+        payload['video_features'], payload['video_clips'] = self.generator.extract_features(job.video_path,
+                                                                                            keep_frames=False)
+        return payload
+
+    def _scoring(self, job, payload):
+        payload['predictions'], payload['confidences'] = self.generator.predict_highlights(payload.pop('video_features'))
+        return payload
+
+    def _selection(self, job, payload):
+        payload['highlight_clips'] = self.generator.select_clips(
+            payload.pop('predictions'),
+            payload.pop('confidences'),
+            payload.pop('video_clips'),
+            payload['fps'],
+            job.highlight_duration_minutes
+        )
+        return payload
+
+    def _render(self, job, payload):
+        highlight_clips = self.generator.read_clips(job.video_path, payload['highlight_clips'])
+        return self.generator.render_highlights(highlight_clips, payload['fps'], job.output_path)
+
+def run_scheduler_example():
+    scheduler = HighlightScheduler(HighlightGenerator())
+
+    # Back-catalog matches go in as bulk work
+    back_catalog = ['Test_video_LowRes_Small.mp4']
+    bulk_jobs = [scheduler.submit(path, 5, priority=BULK) for path in back_catalog]
+
+    # A live match request jumps ahead of the bulk backlog at every stage
+    live_job = scheduler.submit('Test_video_LowRes_Small.mp4', 3, priority=URGENT,
+                                output_path='highlights_live_3min.mp4')
+    print(f"Live highlights generated: {live_job.wait()} ({live_job.stage_times})")
+
+    for job in bulk_jobs:
+        print(f"Bulk highlights generated: {job.wait()}")
+
+    scheduler.shutdown()
+
 def main():
     # Get video path from user
     video_path = 'Test_video_LowRes_Small.mp4'
@@ -1095,7 +2434,11 @@ def main():
     generator = HighlightGenerator()
     output_video = generator.create_highlights(video_path, duration)
 
-    print(f"Highlights generated successfully: {output_video}")
+    if output_video is not None:
+        print(f"Highlights generated successfully: {output_video}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if use_scheduler:
+        run_scheduler_example()
+    else:
+        main()
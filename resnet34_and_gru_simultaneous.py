@@ -18,6 +18,9 @@ import numpy as np
 from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
+from data_pipeline import (pack_video_shards, missing_from_shards, ShardedVideoDataset, CachedFeatureDataset,
+                           loader_kwargs, pad_collate, BucketedBalancedBatchSampler, probe_frame_counts)
+from training_utils import TrainingMonitor
 
 # Check if CUDA is available
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -52,15 +55,40 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        return self.forward_features(features, lengths)
+
+    def forward_features(self, features, lengths=None):
+        # GRU head on precomputed ResNet features of shape (batch, seq_len, feature_size)
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
+    def freeze_backbone(self):
+        for param in self.feature_extractor.parameters():
+            param.requires_grad = False
+
+    def unfreeze_last_block(self):
+        # resnet[-2] is layer4; resnet[-1] is the average pool
+        for param in self.feature_extractor.resnet[-2].parameters():
+            param.requires_grad = True
+
 # Dataset class for video clips
 class VideoDataset(Dataset):
     def __init__(self, video_paths, labels, label_to_index, transform=None):
@@ -95,6 +123,38 @@ class VideoDataset(Dataset):
 
         return frames_tensor, label_idx
 
+def dataset_clip_paths(dataset):
+    """Video path of every clip of a VideoDataset or ShardedVideoDataset, in dataset order"""
+    if hasattr(dataset, 'clips'):
+        return [clip['video_path'] for clip in dataset.clips]
+    return list(dataset.video_paths)
+
+def cache_backbone_features(feature_extractor, dataset, cache_path):
+    """
+    Decode every clip once and store its frozen ResNet features (float16) at cache_path,
+    together with the clip paths and label_to_index they were computed for. An existing
+    cache is only reused when both still match; otherwise it is rebuilt.
+    """
+    clip_paths = dataset_clip_paths(dataset)
+    if os.path.exists(cache_path):
+        cache = torch.load(cache_path)
+        if cache.get('clip_paths') == clip_paths and cache.get('label_to_index') == dataset.label_to_index:
+            print(f"Using cached features from {cache_path}")
+            return
+        print(f"Cached features in {cache_path} are for different clips or labels, rebuilding")
+
+    feature_extractor.eval()
+    features, labels = [], []
+    with torch.no_grad():
+        for idx in tqdm(range(len(dataset)), desc=f"Caching features to {cache_path}"):
+            frames_tensor, label_idx = dataset[idx]
+            clip_features = feature_extractor(frames_tensor.to(device))  # (seq_len, feature_size)
+            features.append(clip_features.half().cpu())
+            labels.append(label_idx)
+
+    torch.save({'features': features, 'labels': labels, 'clip_paths': clip_paths,
+                'label_to_index': dataset.label_to_index}, cache_path)
+
 # Load dataset
 def load_data(root_directory):
     video_paths = []
@@ -112,7 +172,8 @@ def load_data(root_directory):
 root_directory = r'/content/drive/MyDrive/extracted2.5sec - Use'
 video_paths, labels = load_data(root_directory)
 
-unique_labels = list(set(labels))
+# Sorted so the label indices are the same in every run (set order depends on the hash seed)
+unique_labels = sorted(set(labels))
 label_to_index = {label: idx for idx, label in enumerate(unique_labels)}
 index_to_label = {idx: label for label, idx in label_to_index.items()}
 
@@ -129,45 +190,133 @@ num_epochs = 20
 batch_size = 2
 learning_rate = 0.0001
 
+# Frozen-backbone mode (opt-in): ResNet features are computed once into a cache and
+# only the GRU head is trained from it. With unfreeze_epoch set, layer4 of the ResNet
+# is unfrozen from that epoch on and training continues end-to-end on decoded video.
+# Off by default, so the ResNet and GRU are trained end-to-end as before.
+freeze_backbone = False
+unfreeze_epoch = None
+cache_dir = 'feature_cache'
+
+# Directory of pre-decoded uint8 frame shards (opt-in, e.g. 'frame_shards'); when set,
+# clips are decoded once by pack_video_shards and sliced from the shards on every
+# later access. The shards are repacked when clips were added since they were packed.
+shard_dir = None
+
+# Batches of clips with similar frame counts and balanced classes instead of a plain shuffle
+balanced_batches = False
+
+# DataLoader workers decoding the training/validation clips (opt-in, e.g. default_num_workers() // 2).
+# Under spawn (Windows/macOS) each worker re-runs this script, so keep 0 there.
+num_workers = 0
+
 # Create datasets and dataloaders
-train_dataset = VideoDataset(train_paths, train_labels, label_to_index)
-val_dataset = VideoDataset(val_paths, val_labels, label_to_index)
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+if shard_dir:
+    if missing_from_shards(shard_dir, video_paths):
+        pack_video_shards(video_paths, labels, shard_dir)
+    train_dataset = ShardedVideoDataset(shard_dir, label_to_index, train_paths)
+    val_dataset = ShardedVideoDataset(shard_dir, label_to_index, val_paths)
+    train_clip_labels = [label_to_index[clip['label']] for clip in train_dataset.clips]
+    train_clip_lengths = [clip['num_frames'] for clip in train_dataset.clips]
+else:
+    train_dataset = VideoDataset(train_paths, train_labels, label_to_index)
+    val_dataset = VideoDataset(val_paths, val_labels, label_to_index)
+    train_clip_labels = [label_to_index[label] for label in train_labels]
+    train_clip_lengths = probe_frame_counts(train_paths) if balanced_batches else None
+
+if balanced_batches:
+    train_sampler = BucketedBalancedBatchSampler(train_clip_labels, train_clip_lengths, batch_size)
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler,
+                              collate_fn=pad_collate, **loader_kwargs(device, num_workers))
+else:
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True,
+                              collate_fn=pad_collate, **loader_kwargs(device, num_workers))
+val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False,
+                        collate_fn=pad_collate, **loader_kwargs(device, num_workers))
 
 # Instantiate model, loss function, and optimizer
 model = GRUWithResNet(feature_size, hidden_size, output_size).to(device)
 criterion = nn.CrossEntropyLoss()
 optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 
+if freeze_backbone:
+    model.freeze_backbone()
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache_backbone_features(model.feature_extractor, train_dataset, os.path.join(cache_dir, 'train_features.pt'))
+    cache_backbone_features(model.feature_extractor, val_dataset, os.path.join(cache_dir, 'val_features.pt'))
+    cached_train_dataset = CachedFeatureDataset(os.path.join(cache_dir, 'train_features.pt'))
+    if balanced_batches:
+        cached_train_sampler = BucketedBalancedBatchSampler(
+            cached_train_dataset.labels, [len(features) for features in cached_train_dataset.features], batch_size)
+        cached_train_loader = DataLoader(cached_train_dataset, batch_sampler=cached_train_sampler,
+                                         collate_fn=pad_collate, **loader_kwargs(device))
+    else:
+        cached_train_loader = DataLoader(cached_train_dataset, batch_size=batch_size, shuffle=True,
+                                         collate_fn=pad_collate, **loader_kwargs(device))
+    cached_val_loader = DataLoader(CachedFeatureDataset(os.path.join(cache_dir, 'val_features.pt')),
+                                   batch_size=batch_size, shuffle=False,
+                                   collate_fn=pad_collate, **loader_kwargs(device))
+
+# Per-step timings (decode/data wait vs copy vs compute) and epoch throughput summaries
+monitor = TrainingMonitor('resnet_gru_metrics.jsonl', device)
+
 # Training loop
 for epoch in range(num_epochs):
+    if freeze_backbone and unfreeze_epoch is not None and epoch == unfreeze_epoch:
+        print(f"Unfreezing ResNet layer4 at epoch {epoch + 1}")
+        model.unfreeze_last_block()
+
+    # Cached features are valid for as long as the whole backbone stays frozen
+    use_cache = freeze_backbone and (unfreeze_epoch is None or epoch < unfreeze_epoch)
+    forward = model.forward_features if use_cache else model
+    epoch_train_loader = cached_train_loader if use_cache else train_loader
+    epoch_val_loader = cached_val_loader if use_cache else val_loader
+
     model.train()
+    if freeze_backbone:
+        # Keep the BatchNorm statistics of the frozen layers fixed
+        model.feature_extractor.eval()
+        if not use_cache:
+            model.feature_extractor.resnet[-2].train()
+
     total_loss = 0
-    for video_batch, label_batch in tqdm(train_loader, desc=f"Epoch {epoch + 1}/{num_epochs}"):
-        video_batch, label_batch = video_batch.to(device), label_batch.to(device)
-        optimizer.zero_grad()
-        outputs = model(video_batch)
-        loss = criterion(outputs, label_batch)
-        loss.backward()
-        optimizer.step()
+    monitor.start_epoch(epoch)
+    for video_batch, lengths, label_batch in monitor.iterate(tqdm(epoch_train_loader, desc=f"Epoch {epoch + 1}/{num_epochs}")):
+        with monitor.phase('to_device'):
+            video_batch = video_batch.to(device, non_blocking=True)
+            label_batch = label_batch.to(device, non_blocking=True)
+        with monitor.phase('optimizer'):
+            optimizer.zero_grad()
+        with monitor.phase('forward'):
+            outputs = forward(video_batch, lengths)
+            loss = criterion(outputs, label_batch)
+        with monitor.phase('backward'):
+            loss.backward()
+        with monitor.phase('optimizer'):
+            optimizer.step()
         total_loss += loss.item()
+        monitor.end_step(label_batch.size(0))
 
-    avg_loss = total_loss / len(train_loader)
+    avg_loss = total_loss / len(epoch_train_loader)
     print(f"Epoch {epoch + 1}, Training Loss: {avg_loss:.4f}")
 
     # Validation
     model.eval()
     correct, total = 0, 0
     with torch.no_grad():
-        for video_batch, label_batch in val_loader:
-            video_batch, label_batch = video_batch.to(device), label_batch.to(device)
-            outputs = model(video_batch)
+        for video_batch, lengths, label_batch in epoch_val_loader:
+            video_batch = video_batch.to(device, non_blocking=True)
+            label_batch = label_batch.to(device, non_blocking=True)
+            outputs = forward(video_batch, lengths)
             predictions = torch.argmax(outputs, dim=1)
             correct += (predictions == label_batch).sum().item()
             total += label_batch.size(0)
     val_accuracy = correct / total
     print(f"Validation Accuracy: {val_accuracy:.4f}")
+    monitor.end_epoch(train_loss=avg_loss)
+
+monitor.close()
 
 # Save model
 torch.save(model.state_dict(), 'resnet_gru_highlight_model.pth')
@@ -189,6 +338,7 @@ import torch.nn as nn
 import torchvision.models as models
 from torch.utils.data import DataLoader, Dataset
 from sklearn.metrics import confusion_matrix, classification_report
+from data_pipeline import loader_kwargs, pad_collate
 
 # Reuse the previous model classes and dataset class
 class ResNetFeatureExtractor(nn.Module):
@@ -214,13 +364,25 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
 class VideoDataset(Dataset):
@@ -278,13 +440,14 @@ def evaluate_model(model_path, test_directory):
     test_paths, test_labels = load_data(test_directory)
 
     # Create label mapping
-    unique_labels = list(set(test_labels))
+    unique_labels = sorted(set(test_labels))
     label_to_index = {label: idx for idx, label in enumerate(unique_labels)}
     index_to_label = {idx: label for label, idx in label_to_index.items()}
 
     # Create test dataset and dataloader
     test_dataset = VideoDataset(test_paths, test_labels, label_to_index)
-    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False,
+                             collate_fn=pad_collate, **loader_kwargs(device))
 
     # Instantiate model
     model = GRUWithResNet(
@@ -306,9 +469,9 @@ def evaluate_model(model_path, test_directory):
     with torch.no_grad():
         correct = 0
         total = 0
-        for video_batch, label_batch, video_paths in test_loader:
+        for video_batch, lengths, label_batch, video_paths in test_loader:
             video_batch, label_batch = video_batch.to(device), label_batch.to(device)
-            outputs = model(video_batch)
+            outputs = model(video_batch, lengths)
             predictions = torch.argmax(outputs, dim=1)
 
             # Update tracking lists
@@ -383,6 +546,7 @@ import torch.nn as nn
 import torchvision.models as models
 from torch.utils.data import DataLoader, Dataset
 from sklearn.metrics import confusion_matrix, classification_report
+from data_pipeline import loader_kwargs, pad_collate
 
 # Reuse the previous model classes and dataset class
 class ResNetFeatureExtractor(nn.Module):
@@ -408,13 +572,25 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
 class VideoDataset(Dataset):
@@ -472,13 +648,14 @@ def evaluate_model(model_path, test_directory):
     test_paths, test_labels = load_data(test_directory)
 
     # Create label mapping
-    unique_labels = list(set(test_labels))
+    unique_labels = sorted(set(test_labels))
     label_to_index = {label: idx for idx, label in enumerate(unique_labels)}
     index_to_label = {idx: label for label, idx in label_to_index.items()}
 
     # Create test dataset and dataloader
     test_dataset = VideoDataset(test_paths, test_labels, label_to_index)
-    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False,
+                             collate_fn=pad_collate, **loader_kwargs(device))
 
     # Instantiate model
     model = GRUWithResNet(
@@ -500,9 +677,9 @@ def evaluate_model(model_path, test_directory):
     with torch.no_grad():
         correct = 0
         total = 0
-        for video_batch, label_batch, video_paths in test_loader:
+        for video_batch, lengths, label_batch, video_paths in test_loader:
             video_batch, label_batch = video_batch.to(device), label_batch.to(device)
-            outputs = model(video_batch)
+            outputs = model(video_batch, lengths)
             predictions = torch.argmax(outputs, dim=1)
 
             # Update tracking lists
@@ -596,13 +773,25 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
 def predict_video(video_path, model, device, index_to_label):
@@ -690,13 +879,25 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
 def predict_video(video_path, model, device, index_to_label):
@@ -784,13 +985,25 @@ class GRUWithResNet(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         batch_size, seq_len, c, h, w = x.size()
         x = x.view(-1, c, h, w)  # Combine batch and sequence for ResNet
-        features = self.feature_extractor(x)
+        if lengths is not None:
+            # Only real frames go through ResNet; padded frames keep zero features
+            valid = (torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]).view(-1)
+            features = x.new_zeros(batch_size * seq_len, self.gru.input_size)
+            features[valid] = self.feature_extractor(x[valid])
+        else:
+            features = self.feature_extractor(x)
         features = features.view(batch_size, seq_len, -1)  # Reshape back to (batch, seq_len, feature_size)
-        gru_out, _ = self.gru(features)
-        out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each clip's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(features, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = self.fc(hidden[-1])
+        else:
+            gru_out, _ = self.gru(features)
+            out = self.fc(gru_out[:, -1, :])  # Use the last hidden state
         return out
 
 def predict_video(video_path, model, device, index_to_label):
@@ -0,0 +1,415 @@
+import time
+import torch
+import torch.nn as nn
+
+class TemporalDownsampler(nn.Module):
+    """
+    Shortens a (batch, seq_len, features) sequence by `factor` before the GRU.
+
+    Modes:
+        'pool':  mean of every `factor` consecutive frames (no parameters)
+        'conv':  strided 1-D convolution with kernel size and stride `factor`
+        'stack': concatenate every `factor` frames into one step, so the
+                 following feature_reducer mixes them (output is features * factor)
+
+    The sequence is zero-padded up to a multiple of `factor`. When lengths are
+    given, pooling only averages real frames and the returned lengths are the
+    downsampled ones.
+    """
+    def __init__(self, input_size, factor, mode='pool'):
+        super(TemporalDownsampler, self).__init__()
+        if mode not in ('pool', 'conv', 'stack'):
+            raise ValueError(f"Unknown temporal downsampling mode: {mode}")
+
+        self.factor = factor
+        self.mode = mode
+        self.output_size = input_size * factor if mode == 'stack' else input_size
+        if mode == 'conv':
+            self.conv = nn.Conv1d(input_size, input_size, kernel_size=factor, stride=factor)
+
+    def forward(self, x, lengths=None):
+        batch_size, seq_len, input_size = x.size()
+        padded_len = -(-seq_len // self.factor) * self.factor
+        if padded_len != seq_len:
+            x = nn.functional.pad(x, (0, 0, 0, padded_len - seq_len))
+
+        if lengths is not None:
+            mask = torch.arange(padded_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]
+        else:
+            mask = torch.arange(padded_len, device=x.device)[None, :].expand(batch_size, -1) < seq_len
+        x = x * mask.unsqueeze(-1).to(x.dtype)
+
+        steps = padded_len // self.factor
+        if self.mode == 'pool':
+            counts = mask.view(batch_size, steps, self.factor).sum(dim=2, keepdim=True).clamp(min=1)
+            x = x.view(batch_size, steps, self.factor, input_size).sum(dim=2) / counts
+        elif self.mode == 'conv':
+            x = self.conv(x.transpose(1, 2)).transpose(1, 2)
+        else:
+            x = x.reshape(batch_size, steps, self.factor * input_size)
+
+        if lengths is not None:
+            lengths = (lengths + self.factor - 1) // self.factor
+        return x, lengths
+
+def measure_latency(model, input_size, seq_len, batch_size=1, repeats=20, device='cpu'):
+    """Median forward time in milliseconds for a (batch_size, seq_len, input_size) input"""
+    model.eval()
+    x = torch.randn(batch_size, seq_len, input_size, device=device)
+    timings = []
+    with torch.no_grad():
+        model(x)  # Warm-up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(x)
+            if torch.cuda.is_available() and str(device).startswith('cuda'):
+                torch.cuda.synchronize()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+class AttentionEnhancedGRUModel(nn.Module):
+    """
+    GRU over the clip's frame features with attention pooling; returns the
+    {'classification', 'confidence', 'attention_weights'} dict.
+
+    Shared by model_training.py, distributed_training.py and the highlight
+    generators so every script builds the same layers for a checkpoint. The
+    feature reducer (2048 -> 1000) is used by the highlight generator models.
+    """
+    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3, use_feature_reducer=False,
+                 downsample_factor=1, downsample_mode='pool'):
+        super(AttentionEnhancedGRUModel, self).__init__()
+
+        # Optional temporal downsampling so the GRU runs over fewer timesteps
+        if downsample_factor > 1:
+            self.downsampler = TemporalDownsampler(input_size, downsample_factor, downsample_mode)
+            input_size = self.downsampler.output_size
+        else:
+            self.downsampler = None
+
+        # Optional feature reducer
+        self.use_feature_reducer = use_feature_reducer
+        if use_feature_reducer:
+            self.feature_reducer = nn.Linear(input_size, 1000)
+            input_size = 1000
+
+        # GRU Layers with Attention Mechanism
+        self.gru = nn.GRU(input_size, hidden_size, num_layers=num_layers,
+                          batch_first=True, dropout=dropout)
+
+        # Attention Mechanism
+        self.attention_layer = nn.Linear(hidden_size, 1)
+
+        # Fully Connected Layers for Classification
+        self.fc_classification = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size * 2),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size * 2, hidden_size),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size, output_size)
+        )
+
+        # Confidence Score Layer
+        self.fc_confidence = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size // 2),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size // 2, 1),
+            nn.Sigmoid()  # Outputs a confidence score between 0 and 1
+        )
+
+    def forward(self, x, lengths=None):
+        # Ensure input is 3D (batch, sequence, features)
+        if x.dim() == 4:
+            # If 4D, reshape to flatten spatial dimensions
+            x = x.view(x.size(0), x.size(1), -1)
+
+        # Optional temporal downsampling
+        if self.downsampler is not None:
+            x, lengths = self.downsampler(x, lengths)
+
+        # Optional feature reduction
+        if self.use_feature_reducer:
+            x = self.feature_reducer(x)
+
+        # GRU processing (packed when lengths are given, so padded steps are skipped)
+        if lengths is not None:
+            packed = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            gru_out, _ = self.gru(packed)
+            gru_out, _ = nn.utils.rnn.pad_packed_sequence(gru_out, batch_first=True, total_length=x.size(1))
+        else:
+            gru_out, _ = self.gru(x)
+
+        # Attention Mechanism (padded steps are masked out of the softmax)
+        attention_scores = self.attention_layer(gru_out)
+        if lengths is not None:
+            mask = torch.arange(x.size(1), device=x.device)[None, :] < lengths.to(x.device)[:, None]
+            attention_scores = attention_scores.masked_fill(~mask.unsqueeze(-1), float('-inf'))
+        attention_weights = torch.softmax(attention_scores, dim=1)
+        context_vector = torch.sum(gru_out * attention_weights, dim=1)
+
+        # Classification Output
+        classification_output = self.fc_classification(context_vector)
+
+        # Confidence Score Output
+        confidence_score = self.fc_confidence(context_vector)
+
+        return {
+            'classification': classification_output,
+            'confidence': confidence_score,
+            'attention_weights': attention_weights
+        }
+
+class EnhancedGRUModel(nn.Module):
+    """
+    Multi-layer GRU classifier on the last hidden state, returning logits.
+    Checkpoints record hidden_size, num_layers, downsample_* and
+    use_feature_reducer; compress_enhanced_gru shrinks it in place.
+    """
+    def __init__(self, input_size, hidden_size, output_size, num_layers=3, dropout=0.3, use_feature_reducer=False,
+                 downsample_factor=1, downsample_mode='pool'):
+        super(EnhancedGRUModel, self).__init__()
+
+        # Optional temporal downsampling so the GRU runs over fewer timesteps
+        if downsample_factor > 1:
+            self.downsampler = TemporalDownsampler(input_size, downsample_factor, downsample_mode)
+            input_size = self.downsampler.output_size
+        else:
+            self.downsampler = None
+
+        # Optional feature reducer
+        self.use_feature_reducer = use_feature_reducer
+        if use_feature_reducer:
+            self.feature_reducer = nn.Linear(input_size, 1000)  # Reduce features to 1000
+            input_size = 1000
+
+        # Add multiple GRU layers
+        self.gru = nn.GRU(input_size, hidden_size, num_layers=num_layers, batch_first=True, dropout=dropout)
+
+        # Fully connected layers with increased hidden size
+        self.fc1 = nn.Linear(hidden_size, hidden_size * 2)  # Increase the size of the first FC layer
+        self.fc2 = nn.Linear(hidden_size * 2, hidden_size)  # Keep the second layer the same size
+        self.fc3 = nn.Linear(hidden_size, output_size)  # Final output layer
+        self.relu = nn.ReLU()
+        self.dropout = nn.Dropout(dropout)  # Dropout layer
+
+    def forward(self, x, lengths=None):
+        # Optional temporal downsampling
+        if self.downsampler is not None:
+            x, lengths = self.downsampler(x, lengths)
+
+        # Optional feature reduction
+        if self.use_feature_reducer:
+            x = self.feature_reducer(x)
+
+        if lengths is not None:
+            # Packed sequence: padded steps are skipped and h_n is each sequence's true last state
+            packed = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, hidden = self.gru(packed)
+            out = hidden[-1]
+        else:
+            out, _ = self.gru(x)
+            out = out[:, -1, :]  # Take the output from the last time step
+        out = self.fc1(out)
+        out = self.relu(out)
+        out = self.dropout(out)  # Apply dropout
+        out = self.fc2(out)
+        out = self.relu(out)
+        out = self.dropout(out)  # Apply dropout again
+        return self.fc3(out)
+
+class DilatedTemporalConv(nn.Module):
+    """Residual stack of 1-D convolutions whose dilation doubles every layer"""
+    def __init__(self, hidden_size, num_layers=4, kernel_size=3, dropout=0.3):
+        super(DilatedTemporalConv, self).__init__()
+        self.layers = nn.ModuleList([
+            nn.Conv1d(hidden_size, hidden_size, kernel_size,
+                      dilation=2 ** i, padding=(kernel_size - 1) * 2 ** i // 2)
+            for i in range(num_layers)
+        ])
+        self.relu = nn.ReLU()
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x, mask):
+        # x: (batch, seq_len, hidden_size); padded steps are kept at zero after every layer
+        x = x.transpose(1, 2)
+        step_mask = mask.unsqueeze(1).to(x.dtype)
+        for conv in self.layers:
+            x = (x + self.dropout(self.relu(conv(x)))) * step_mask
+        return x.transpose(1, 2)
+
+class TemporalEncoderModel(nn.Module):
+    """
+    Alternative to AttentionEnhancedGRUModel whose temporal encoder processes all
+    timesteps in parallel: a dilated temporal convolution stack ('tcn') or a
+    small transformer encoder ('transformer').
+
+    Returns the same {'classification', 'confidence', 'attention_weights'} dict,
+    so it can be used anywhere the attention GRU is.
+    """
+    def __init__(self, input_size, hidden_size, output_size, encoder='tcn', num_layers=4, dropout=0.3,
+                 use_feature_reducer=True, downsample_factor=1, downsample_mode='pool',
+                 kernel_size=3, num_heads=8):
+        super(TemporalEncoderModel, self).__init__()
+
+        # Optional temporal downsampling
+        if downsample_factor > 1:
+            self.downsampler = TemporalDownsampler(input_size, downsample_factor, downsample_mode)
+            input_size = self.downsampler.output_size
+        else:
+            self.downsampler = None
+
+        # Optional feature reducer
+        self.use_feature_reducer = use_feature_reducer
+        if use_feature_reducer:
+            self.feature_reducer = nn.Linear(input_size, 1000)
+            input_size = 1000
+
+        self.input_projection = nn.Linear(input_size, hidden_size)
+
+        self.encoder_type = encoder
+        if encoder == 'tcn':
+            self.encoder = DilatedTemporalConv(hidden_size, num_layers, kernel_size, dropout)
+        elif encoder == 'transformer':
+            layer = nn.TransformerEncoderLayer(hidden_size, num_heads, hidden_size * 2, dropout, batch_first=True)
+            self.encoder = nn.TransformerEncoder(layer, num_layers, enable_nested_tensor=False)
+        else:
+            raise ValueError(f"Unknown temporal encoder: {encoder}")
+
+        # Attention Mechanism
+        self.attention_layer = nn.Linear(hidden_size, 1)
+
+        # Fully Connected Layers for Classification
+        self.fc_classification = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size * 2),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size * 2, hidden_size),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size, output_size)
+        )
+
+        # Confidence Score Layer
+        self.fc_confidence = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size // 2),
+            nn.ReLU(),
+            nn.Dropout(dropout),
+            nn.Linear(hidden_size // 2, 1),
+            nn.Sigmoid()
+        )
+
+    def positional_encoding(self, seq_len, hidden_size, device):
+        # Sinusoidal encoding so the transformer knows the order of the frames
+        position = torch.arange(seq_len, device=device, dtype=torch.float32).unsqueeze(1)
+        div_term = torch.exp(torch.arange(0, hidden_size, 2, device=device, dtype=torch.float32)
+                             * (-torch.log(torch.tensor(10000.0)) / hidden_size))
+        encoding = torch.zeros(seq_len, hidden_size, device=device)
+        encoding[:, 0::2] = torch.sin(position * div_term)
+        encoding[:, 1::2] = torch.cos(position * div_term[:hidden_size // 2])
+        return encoding
+
+    def forward(self, x, lengths=None):
+        if self.downsampler is not None:
+            x, lengths = self.downsampler(x, lengths)
+
+        if self.use_feature_reducer:
+            x = self.feature_reducer(x)
+
+        seq_len = x.size(1)
+        if lengths is not None:
+            mask = torch.arange(seq_len, device=x.device)[None, :] < lengths.to(x.device)[:, None]
+        else:
+            mask = torch.ones(x.size(0), seq_len, dtype=torch.bool, device=x.device)
+
+        x = self.input_projection(x) * mask.unsqueeze(-1).to(x.dtype)
+
+        if self.encoder_type == 'tcn':
+            encoded = self.encoder(x, mask)
+        else:
+            x = x + self.positional_encoding(seq_len, x.size(2), x.device)
+            encoded = self.encoder(x, src_key_padding_mask=~mask)
+
+        # Attention pooling over real timesteps only
+        attention_scores = self.attention_layer(encoded).masked_fill(~mask.unsqueeze(-1), float('-inf'))
+        attention_weights = torch.softmax(attention_scores, dim=1)
+        context_vector = torch.sum(encoded * attention_weights, dim=1)
+
+        return {
+            'classification': self.fc_classification(context_vector),
+            'confidence': self.fc_confidence(context_vector),
+            'attention_weights': attention_weights
+        }
+
+class LowRankLinear(nn.Module):
+    """Linear layer factorized as (out x rank) @ (rank x in), e.g. from a truncated SVD"""
+    def __init__(self, in_features, out_features, rank):
+        super(LowRankLinear, self).__init__()
+        self.down = nn.Linear(in_features, rank, bias=False)
+        self.up = nn.Linear(rank, out_features)
+
+    @classmethod
+    def from_linear(cls, linear, rank):
+        layer = cls(linear.in_features, linear.out_features, rank)
+        u, s, vh = torch.linalg.svd(linear.weight.data, full_matrices=False)
+        root_s = s[:rank].sqrt()
+        layer.down.weight.data.copy_(root_s[:, None] * vh[:rank])
+        layer.up.weight.data.copy_(u[:, :rank] * root_s[None, :])
+        layer.up.bias.data.copy_(linear.bias.data)
+        return layer
+
+    def forward(self, x):
+        return self.up(self.down(x))
+
+def _prune_gru(gru, keep_size):
+    """Smaller GRU keeping the `keep_size` hidden units of each layer with the largest weights"""
+    hidden_size = gru.hidden_size
+    pruned = nn.GRU(gru.input_size, keep_size, num_layers=gru.num_layers,
+                    batch_first=gru.batch_first, dropout=gru.dropout)
+    kept_per_layer = []
+    previous_keep = None
+    for layer in range(gru.num_layers):
+        weight_ih = getattr(gru, f'weight_ih_l{layer}').data
+        weight_hh = getattr(gru, f'weight_hh_l{layer}').data
+
+        # Rank a unit by the norm of its rows across the reset, update and new gates
+        importance = (weight_ih.view(3, hidden_size, -1).norm(dim=(0, 2))
+                      + weight_hh.view(3, hidden_size, -1).norm(dim=(0, 2)))
+        keep = importance.topk(keep_size).indices.sort().values
+        rows = torch.cat([keep + gate * hidden_size for gate in range(3)])
+
+        if previous_keep is not None:
+            weight_ih = weight_ih[:, previous_keep]
+        getattr(pruned, f'weight_ih_l{layer}').data.copy_(weight_ih[rows])
+        getattr(pruned, f'weight_hh_l{layer}').data.copy_(weight_hh[rows][:, keep])
+        getattr(pruned, f'bias_ih_l{layer}').data.copy_(getattr(gru, f'bias_ih_l{layer}').data[rows])
+        getattr(pruned, f'bias_hh_l{layer}').data.copy_(getattr(gru, f'bias_hh_l{layer}').data[rows])
+
+        kept_per_layer.append(keep)
+        previous_keep = keep
+    return pruned, kept_per_layer[-1]
+
+def compress_enhanced_gru(model, gru_hidden_size=None, fc_rank=None):
+    """
+    Shrink an EnhancedGRUModel in place: structured pruning of the GRU hidden
+    units down to gru_hidden_size, then truncated-SVD factorization of fc1 and
+    fc2 to rank fc_rank. Either step is skipped when its argument is None.
+
+    Applying the same settings to a freshly constructed model gives the layout
+    of a compressed checkpoint, so it can be loaded with load_state_dict.
+    """
+    device = model.fc3.weight.device
+    if gru_hidden_size is not None and gru_hidden_size < model.gru.hidden_size:
+        model.gru, keep = _prune_gru(model.gru, gru_hidden_size)
+        fc1 = nn.Linear(gru_hidden_size, model.fc1.out_features)
+        fc1.weight.data.copy_(model.fc1.weight.data[:, keep])
+        fc1.bias.data.copy_(model.fc1.bias.data)
+        model.fc1 = fc1
+
+    if fc_rank is not None:
+        model.fc1 = LowRankLinear.from_linear(model.fc1, fc_rank)
+        model.fc2 = LowRankLinear.from_linear(model.fc2, fc_rank)
+    return model.to(device)
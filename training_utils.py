@@ -0,0 +1,249 @@
+import csv
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _to_cpu(obj):
+    """Copy every tensor in a (nested) checkpoint to CPU so training can keep updating the originals"""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: _to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+def atomic_save(state, path):
+    """torch.save to a temp file next to `path`, then rename it into place"""
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints on a background thread.
+
+    save() snapshots the state to CPU on the caller's thread and returns; the
+    file is written with atomic_save, so a preemption mid-write never leaves a
+    truncated checkpoint behind. At most one write is queued, a further save()
+    waits for it. Errors from the writer are raised on the next call.
+    """
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            state, path = item
+            try:
+                atomic_save(state, path)
+            except Exception as e:
+                self._error = e
+            self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, state, path):
+        self._raise_error()
+        self._queue.put((_to_cpu(state), path))
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+def capture_rng_state(*generators):
+    """Python, NumPy, torch (and CUDA) RNG state plus the state of any sampler generators"""
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        'generators': [generator.get_state() for generator in generators]
+    }
+
+def restore_rng_state(state, *generators):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'].cpu())
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([cuda_state.cpu() for cuda_state in state['cuda']])
+    for generator, generator_state in zip(generators, state['generators']):
+        generator.set_state(generator_state.cpu())
+
+def training_state(epoch, model, optimizer, best_loss, *generators, **extra):
+    """Everything needed to continue training after `epoch` exactly as if it had not stopped"""
+    state = {
+        'epoch': epoch,
+        'model_state_dict': model.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'best_loss': best_loss,
+        'rng_state': capture_rng_state(*generators)
+    }
+    state.update(extra)
+    return state
+
+def load_training_state(path, model, optimizer, *generators, map_location=None):
+    """Restore a state written from training_state(); returns it for the epoch, best_loss and extras"""
+    state = torch.load(path, map_location=map_location, weights_only=False)
+    model.load_state_dict(state['model_state_dict'])
+    optimizer.load_state_dict(state['optimizer_state_dict'])
+    restore_rng_state(state['rng_state'], *generators)
+    return state
+
+class TrainingMonitor:
+    """
+    Per-step timing of a training loop: time spent waiting on the DataLoader,
+    copying to the device, forward, backward and the optimizer step, plus
+    samples/sec, peak RSS and (on CUDA) peak device memory.
+
+    Every step and an end-of-epoch summary are appended to log_path (JSON lines,
+    or CSV when it ends in .csv) and the summary is printed.
+
+        monitor.start_epoch(epoch)
+        for batch in monitor.iterate(loader):
+            with monitor.phase('to_device'): ...
+            with monitor.phase('forward'): ...
+            with monitor.phase('backward'): ...
+            with monitor.phase('optimizer'): ...
+            monitor.end_step(batch_size)
+        monitor.end_epoch(train_loss=...)
+
+    On CUDA the device is synchronized around each phase so the kernels are
+    attributed to the phase that launched them.
+    """
+    PHASES = ('data_wait', 'to_device', 'forward', 'backward', 'optimizer')
+    CSV_FIELDS = ('type', 'epoch', 'step', 'steps', 'samples', 'wall_time', 'samples_per_sec') + PHASES + (
+        'peak_rss_mb', 'peak_device_mb', 'train_loss', 'val_loss')
+
+    def __init__(self, log_path, device, log_steps=True, print_summary=True):
+        self.device = torch.device(device)
+        self.log_steps = log_steps
+        self.print_summary = print_summary
+        self.is_csv = log_path.endswith('.csv')
+        write_header = self.is_csv and (not os.path.exists(log_path) or os.path.getsize(log_path) == 0)
+        self._file = open(log_path, 'a', newline='')
+        if self.is_csv:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+            if write_header:
+                self._writer.writeheader()
+
+    def _write(self, record):
+        if self.is_csv:
+            self._writer.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def start_epoch(self, epoch):
+        self.epoch = epoch
+        self.steps = 0
+        self.samples = 0
+        self.totals = dict.fromkeys(self.PHASES, 0.0)
+        self._current = {}
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self._epoch_start = time.perf_counter()
+        self._train_end = None
+
+    def iterate(self, loader):
+        """Yield the loader's batches, timing how long each one took to arrive"""
+        iterator = iter(loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                self._train_end = time.perf_counter()
+                return
+            self._current = {'data_wait': time.perf_counter() - start}
+            yield batch
+
+    @contextmanager
+    def phase(self, name):
+        self._sync()
+        start = time.perf_counter()
+        yield
+        self._sync()
+        self._current[name] = self._current.get(name, 0.0) + time.perf_counter() - start
+
+    def end_step(self, batch_size):
+        step_time = sum(self._current.values())
+        for name, seconds in self._current.items():
+            self.totals[name] += seconds
+        self.steps += 1
+        self.samples += batch_size
+        if self.log_steps:
+            self._write({'type': 'step', 'epoch': self.epoch + 1, 'step': self.steps, 'samples': batch_size,
+                         'samples_per_sec': batch_size / step_time if step_time > 0 else None,
+                         **{name: self._current.get(name, 0.0) for name in self.PHASES}})
+        self._current = {}
+
+    def end_epoch(self, **metrics):
+        # Rates cover the training pass only, validation run before this call is excluded
+        wall_time = (self._train_end or time.perf_counter()) - self._epoch_start
+        record = {
+            'type': 'epoch',
+            'epoch': self.epoch + 1,
+            'steps': self.steps,
+            'samples': self.samples,
+            'wall_time': wall_time,
+            'samples_per_sec': self.samples / wall_time if wall_time > 0 else None,
+            **self.totals,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_device_mb': (torch.cuda.max_memory_allocated(self.device) / 1024 ** 2
+                               if self.device.type == 'cuda' else None),
+            **metrics
+        }
+        self._write(record)
+        if not self.print_summary:
+            return record
+
+        # Share of the training pass per phase; the rest is loss bookkeeping, logging etc.
+        shares = ' | '.join(f"{name} {100 * self.totals[name] / wall_time:.0f}%" for name in self.PHASES)
+        memory = f"peak RSS {record['peak_rss_mb']:.0f} MB" if record['peak_rss_mb'] is not None else "peak RSS n/a"
+        if record['peak_device_mb'] is not None:
+            memory += f", device {record['peak_device_mb']:.0f} MB"
+        print(f"Epoch {self.epoch + 1} throughput: {record['samples_per_sec']:.1f} samples/s | {shares} | {memory}")
+        return record
+
+    def close(self):
+        self._file.close()
+
+def peak_rss_mb():
+    """Peak resident set size of this process (DataLoader workers not included), None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024